@@ -5,112 +5,1439 @@
 # Primero, importamos todas las herramientas que vamos a necesitar
 # Son como los ingredientes de nuestra receta digital
 import os
+import re
+import sys
+import json
+import time
+import uuid
+import zlib
+import shutil
+import sqlite3
+import hashlib
+import random
+import asyncio
+import argparse
+import tempfile
+import threading
+import unicodedata
+from array import array
+from itertools import groupby
+try:
+    import resource  # Solo existe en Linux/Mac: lo usamos para medir el pico de memoria
+except ImportError:
+    resource = None
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
 from langchain.document_loaders import TextLoader  # Para cargar archivos de texto
 from langchain.text_splitter import CharacterTextSplitter  # Para cortar el texto en cachitos
 from langchain.embeddings import OpenAIEmbeddings  # Para convertir texto a números (vectores)
+from langchain.embeddings.base import Embeddings  # La "forma" que debe tener cualquier embedder
 from langchain.vectorstores import Chroma  # Nuestra base de datos donde guardamos los vectores
+from langchain.vectorstores.base import VectorStore  # La "forma" que debe tener cualquier base vectorial
+from langchain.schema import Document  # Un pedazo de texto con sus metadatos
+from langchain.schema import BaseRetriever  # La "forma" que debe tener cualquier recuperador
 from langchain.chat_models import ChatOpenAI  # El modelo de lenguaje que va a responder
 from langchain.chains import RetrievalQA  # La cadena que une todo: recuperación + generación
+from langchain.chains.question_answering.stuff_prompt import PROMPT_SELECTOR  # El prompt que usa "stuff"
+
+try:
+    from aiohttp import web  # Opcional: solo lo usa el servidor HTTP (--servir)
+except ImportError:
+    web = None
 
 # =============================================================================
 # PASO 1: CARGAR Y PROCESAR LOS DOCUMENTOS
 # =============================================================================
 
-def cargar_y_procesar_documentos(ruta_archivos):
+def buscar_archivos_txt(ruta_archivos):
+    """Recorre la carpeta (y sus subcarpetas) buscando archivos .txt"""
+    for carpeta, _, archivos in os.walk(ruta_archivos):
+        for archivo in sorted(archivos):
+            if archivo.endswith('.txt'):
+                yield os.path.join(carpeta, archivo)
+
+def cargar_y_dividir_archivo(ruta, chunk_size=1000, chunk_overlap=100):
+    """
+    Carga UN archivo y lo corta en fragmentos. Vive a nivel de módulo para
+    que los procesos del pool puedan usarla.
+    """
+    documentos = TextLoader(ruta).load()
+    # Es como si hiciéramos flashcards de un libro grande
+    text_splitter = CharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return text_splitter.split_documents(documentos)
+
+def generar_fragmentos(rutas, procesos=None, chunk_size=1000, chunk_overlap=100, stats=None):
+    """
+    Lee y divide los archivos en paralelo (un proceso por núcleo) y va
+    entregando los fragmentos poco a poco, archivo por archivo. Nunca hay más
+    de unos cuantos archivos "en vuelo", así que la memoria no crece con el corpus.
+    """
+    procesos = procesos or os.cpu_count() or 1
+    max_en_vuelo = procesos * 2
+    rutas = iter(rutas)
+    
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        pendientes = set()
+        while True:
+            # Llenamos el pool hasta el límite de archivos en vuelo
+            for ruta in rutas:
+                pendientes.add(pool.submit(cargar_y_dividir_archivo, ruta, chunk_size, chunk_overlap))
+                if len(pendientes) >= max_en_vuelo:
+                    break
+            if not pendientes:
+                break
+            
+            listos, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+            for futuro in listos:
+                fragmentos = futuro.result()
+                if stats is not None:
+                    stats["archivos"] += 1
+                    stats["fragmentos"] += len(fragmentos)
+                # Los fragmentos de un archivo salen juntos (crear_base_vectorial cuenta con eso)
+                yield from fragmentos
+
+def cargar_y_procesar_documentos(ruta_archivos, procesos=None, chunk_size=1000, chunk_overlap=100):
     """
     Esta función se encarga de cargar los documentos y cortarlos en pedacitos
     más pequeños para que el modelo no se ahogue con tanto texto de golpe.
+    
+    Devuelve un generador: los fragmentos se van produciendo mientras se
+    embeben, en lugar de tener todo el corpus en memoria a la vez.
     """
     print("📂 Cargando documentos...")
     
-    # Cargamos todos los archivos de texto de la carpeta que indiquemos
+    # Buscamos todos los archivos de texto de la carpeta que indiquemos (y sus subcarpetas)
     # Es como abrir todos los libros que queremos que nuestra IA aprenda
-    loaders = []
-    for archivo in os.listdir(ruta_archivos):
-        if archivo.endswith('.txt'):
-            ruta_completa = os.path.join(ruta_archivos, archivo)
-            loaders.append(TextLoader(ruta_completa))
+    rutas = list(buscar_archivos_txt(ruta_archivos))
     
     # Si no hay archivos, nos vamos a casa
-    if not loaders:
+    if not rutas:
         print("❌ No hay archivos .txt en la carpeta especificada")
         return None
     
-    # Cargamos los documentos
-    documentos = []
-    for loader in loaders:
-        documentos.extend(loader.load())
-    
-    print(f"✅ Se cargaron {len(documentos)} documentos")
+    print(f"✅ Se encontraron {len(rutas)} documentos")
     
-    # Ahora cortamos los documentos en pedazos más pequeños
-    # Es como si hiciéramos flashcards de un libro grande
-    text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-    textos = text_splitter.split_documents(documentos)
+    def fragmentos_con_resumen():
+        stats = {"archivos": 0, "fragmentos": 0}
+        yield from generar_fragmentos(rutas, procesos=procesos, chunk_size=chunk_size,
+                                      chunk_overlap=chunk_overlap, stats=stats)
+        print(f"✂️ Se dividieron en {stats['fragmentos']} fragmentos")
     
-    print(f"✂️ Se dividieron en {len(textos)} fragmentos")
-    
-    return textos
+    return fragmentos_con_resumen()
+
+def benchmark_ingesta(num_archivos=400, kb_por_archivo=64, procesos=None):
+    """
+    Mide cuántos archivos/s y MB/s procesa la ingesta sobre un corpus sintético,
+    comparando un solo proceso contra el pool completo.
+    """
+    carpeta = tempfile.mkdtemp(prefix="corpus_rag_")
+    try:
+        parrafo = "El cerebrito lee documentos y los corta en fragmentos pequeños. " * 8
+        for i in range(num_archivos):
+            subcarpeta = os.path.join(carpeta, f"tema_{i % 10}")
+            os.makedirs(subcarpeta, exist_ok=True)
+            with open(os.path.join(subcarpeta, f"doc_{i}.txt"), "w", encoding="utf-8") as f:
+                while f.tell() < kb_por_archivo * 1024:
+                    f.write(f"Documento {i}. {parrafo}\n\n")
+        
+        rutas = list(buscar_archivos_txt(carpeta))
+        megas = sum(os.path.getsize(r) for r in rutas) / 1e6
+        print(f"📊 Corpus sintético: {len(rutas)} archivos, {megas:.1f} MB")
+        
+        for n in sorted({1, procesos or os.cpu_count() or 1}):
+            stats = {"archivos": 0, "fragmentos": 0}
+            inicio = time.perf_counter()
+            for _ in generar_fragmentos(rutas, procesos=n, stats=stats):
+                pass
+            segundos = time.perf_counter() - inicio
+            print(f"   {n:>2} procesos: {stats['archivos'] / segundos:8.1f} archivos/s  "
+                  f"{megas / segundos:6.1f} MB/s  ({stats['fragmentos']} fragmentos en {segundos:.2f}s)")
+    finally:
+        shutil.rmtree(carpeta, ignore_errors=True)
 
 # =============================================================================
 # PASO 2: CREAR Y GUARDAR LOS VECTORES
 # =============================================================================
 
-def crear_base_vectorial(textos, nombre_db="mi_base_vectorial"):
+class CacheDeEmbeddings(Embeddings):
     """
-    Aquí convertimos los textos en vectores (números) y los guardamos
-    en una base de datos especial. Es como traducir nuestros documentos
-    al idioma que entienden las máquinas.
+    Envuelve cualquier función de embeddings y guarda cada vector en un SQLite,
+    con clave (modelo, hash del texto normalizado). Si el mismo texto ya se
+    embebió antes (en otra base o con otro tamaño de fragmento), sale gratis.
     """
-    print("🔄 Creando embeddings (traduciendo texto a números)...")
+    
+    def __init__(self, embeddings, ruta="./cache_embeddings.sqlite", max_entradas=500_000, tamano_tramo=512):
+        self.embeddings = embeddings
+        self.tamano_tramo = tamano_tramo  # Cada cuántos textos nuevos se guarda en disco (punto de control)
+        self.modelo = getattr(embeddings, "model", None) or type(embeddings).__name__
+        self.max_entradas = max_entradas
+        self.aciertos = 0
+        self.fallos = 0
+        # La conexión se comparte entre hilos (servidor), así que cada acceso va con candado
+        self.candado = threading.Lock()
+        self.conexion = sqlite3.connect(ruta, check_same_thread=False)
+        self.conexion.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(clave TEXT PRIMARY KEY, vector BLOB, ultimo_uso REAL)"
+        )
+        self.conexion.execute("CREATE INDEX IF NOT EXISTS idx_uso ON embeddings (ultimo_uso)")
+        self.conexion.commit()
+        # Conteo de filas al día, para no hacer COUNT(*) en cada escritura
+        self.filas = self.conexion.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+    
+    def clave(self, texto):
+        # Normalizamos espacios para que "hola  mundo" y "hola mundo" compartan vector
+        normalizado = " ".join(texto.split())
+        return hash_texto(f"{self.modelo}\n{normalizado}")
+    
+    def embed_documents(self, texts):
+        claves = [self.clave(t) for t in texts]
+        encontrados = {}
+        
+        # SQLite limita el número de parámetros por consulta, así que vamos por tandas
+        unicas = list(dict.fromkeys(claves))
+        with self.candado:
+            for i in range(0, len(unicas), 500):
+                tanda = unicas[i:i + 500]
+                marcas = ",".join("?" * len(tanda))
+                for clave, blob in self.conexion.execute(
+                    f"SELECT clave, vector FROM embeddings WHERE clave IN ({marcas})", tanda
+                ):
+                    encontrados[clave] = array("f", blob).tolist()
+        
+            # Solo mandamos a la API los textos que no estaban en la caché (sin repetir)
+            faltantes = {}
+            for clave, texto in zip(claves, texts):
+                if clave not in encontrados and clave not in faltantes:
+                    faltantes[clave] = texto
+            self.aciertos += len(texts) - len(faltantes)
+            self.fallos += len(faltantes)
+        
+        ahora = time.time()
+        # Vamos por tramos y guardamos cada uno en cuanto llega: si el programa se cae
+        # a la mitad, lo ya embebido queda en la caché y no se vuelve a pagar
+        pendientes = list(faltantes.items())
+        for i in range(0, len(pendientes), self.tamano_tramo):
+            tramo = pendientes[i:i + self.tamano_tramo]
+            vectores = self.embeddings.embed_documents([texto for _, texto in tramo])
+            filas = []
+            for (clave, _), vector in zip(tramo, vectores):
+                encontrados[clave] = list(vector)
+                filas.append((clave, array("f", vector).tobytes(), ahora))
+            with self.candado:
+                self.guardar_filas(filas)
+        
+        # Marcamos los usados para que la limpieza borre primero los más viejos
+        with self.candado:
+            self.conexion.executemany(
+                "UPDATE embeddings SET ultimo_uso = ? WHERE clave = ?",
+                [(ahora, clave) for clave in unicas if clave not in faltantes]
+            )
+            self.conexion.commit()
+        
+        return [encontrados[clave] for clave in claves]
+    
+    def embed_query(self, text):
+        """
+        Camino rápido para las preguntas: un SELECT y nada más. Un acierto no se
+        escribe (ni se hace commit ni limpieza); solo una pregunta nueva se guarda.
+        """
+        clave = self.clave(text)
+        with self.candado:
+            fila = self.conexion.execute("SELECT vector FROM embeddings WHERE clave = ?", (clave,)).fetchone()
+            if fila is not None:
+                self.aciertos += 1
+                return array("f", fila[0]).tolist()
+            self.fallos += 1
+        
+        vector = list(self.embeddings.embed_query(text))
+        with self.candado:
+            self.guardar_filas([(clave, array("f", vector).tobytes(), time.time())])
+        return vector
+    
+    def guardar_filas(self, filas):
+        """Guarda vectores nuevos (con el candado tomado) y limpia si la caché se pasó del límite"""
+        self.conexion.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", filas)
+        self.filas += len(filas)
+        self.limpiar()
+        self.conexion.commit()
+    
+    def limpiar(self):
+        """Si la caché pasa del límite, borra las entradas usadas hace más tiempo"""
+        sobran = self.filas - self.max_entradas
+        if sobran > 0:
+            cursor = self.conexion.execute(
+                "DELETE FROM embeddings WHERE clave IN "
+                "(SELECT clave FROM embeddings ORDER BY ultimo_uso LIMIT ?)", (sobran,)
+            )
+            self.filas -= cursor.rowcount
+    
+    def estadisticas(self):
+        total = self.aciertos + self.fallos
+        tasa = self.aciertos / total * 100 if total else 0
+        return f"{self.aciertos} aciertos, {self.fallos} fallos ({tasa:.0f}% desde caché)"
+
+def estimar_tokens(texto):
+    """Estimación rápida: ~4 caracteres por token"""
+    return len(texto) // 4 + 1
+
+class LimitadorTokens:
+    """Cubeta de tokens por minuto, segura para usar desde varios hilos"""
+    
+    def __init__(self, tokens_por_minuto):
+        self.tpm = tokens_por_minuto
+        self.disponibles = float(tokens_por_minuto)
+        self.actualizado = time.monotonic()
+        self.candado = threading.Lock()
+    
+    def esperar(self, tokens):
+        tokens = min(tokens, self.tpm)  # Un lote enorme no puede esperar para siempre
+        with self.candado:
+            while True:
+                ahora = time.monotonic()
+                self.disponibles = min(self.tpm, self.disponibles + (ahora - self.actualizado) * self.tpm / 60)
+                self.actualizado = ahora
+                if self.disponibles >= tokens:
+                    self.disponibles -= tokens
+                    return
+                time.sleep((tokens - self.disponibles) * 60 / self.tpm)
+
+class EmbedderPorLotes(Embeddings):
+    """
+    Envuelve un embedder y arma lotes por tamaño en tokens, manda varios lotes
+    a la vez (hilos), respeta un límite de tokens por minuto y, si un lote
+    falla, reintenta solo ese lote con espera exponencial.
+    """
+    
+    def __init__(self, embeddings, max_tokens_lote=8000, max_textos_lote=256, hilos=4,
+                 tokens_por_minuto=1_000_000, reintentos=5):
+        self.embeddings = embeddings
+        self.model = getattr(embeddings, "model", None) or type(embeddings).__name__
+        self.max_tokens_lote = max_tokens_lote
+        self.max_textos_lote = max_textos_lote
+        self.hilos = hilos
+        self.limitador = LimitadorTokens(tokens_por_minuto) if tokens_por_minuto else None
+        self.reintentos = reintentos
+        self.lotes_reintentados = 0
+    
+    def armar_lotes(self, texts):
+        """Agrupa índices de textos en lotes que no pasen del límite de tokens ni de textos"""
+        lotes, actual, tokens_actual = [], [], 0
+        for i, texto in enumerate(texts):
+            tokens = estimar_tokens(texto)
+            if actual and (tokens_actual + tokens > self.max_tokens_lote or len(actual) >= self.max_textos_lote):
+                lotes.append((actual, tokens_actual))
+                actual, tokens_actual = [], 0
+            actual.append(i)
+            tokens_actual += tokens
+        if actual:
+            lotes.append((actual, tokens_actual))
+        return lotes
+    
+    def embeber_lote(self, textos, tokens):
+        for intento in range(self.reintentos + 1):
+            if self.limitador is not None:
+                self.limitador.esperar(tokens)
+            try:
+                return self.embeddings.embed_documents(textos)
+            except Exception:
+                if intento == self.reintentos:
+                    raise
+                self.lotes_reintentados += 1
+                # Espera exponencial con un poco de azar para no chocar con los otros hilos
+                time.sleep(min(60, 2 ** intento) * random.uniform(0.5, 1.0))
+    
+    def embed_documents(self, texts):
+        resultado = [None] * len(texts)
+        with ThreadPoolExecutor(max_workers=self.hilos) as pool:
+            futuros = {
+                pool.submit(self.embeber_lote, [texts[i] for i in indices], tokens): indices
+                for indices, tokens in self.armar_lotes(texts)
+            }
+            for futuro, indices in futuros.items():
+                for i, vector in zip(indices, futuro.result()):
+                    resultado[i] = vector
+        return resultado
+    
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+# El manifiesto es la "lista de asistencia" de la base: qué archivo aportó qué
+# fragmentos, con un hash de su contenido. Así sabemos qué cambió sin re-embeber todo.
+NOMBRE_MANIFIESTO = "manifiesto.json"
+# Índice de palabras (BM25) que vive junto a la base vectorial
+NOMBRE_LEXICO = "lexico.sqlite"
+
+def hash_texto(texto):
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+def ids_de_fragmentos(fuente, docs):
+    """
+    Le pone a cada fragmento de un archivo un ID que depende solo de su
+    contenido (si el texto no cambia, el ID tampoco). Devuelve también el
+    hash del archivo completo.
+    """
+    vistos = {}
+    fragmentos = []
+    for doc in docs:
+        # Si un mismo texto se repite dentro del archivo, lo numeramos para no chocar
+        h = hash_texto(doc.page_content)
+        vistos[h] = vistos.get(h, 0) + 1
+        id_fragmento = hash_texto(f"{fuente}\n{h}\n{vistos[h]}")
+        fragmentos.append((id_fragmento, doc))
+    
+    hash_archivo = hash_texto("".join(id_f for id_f, _ in fragmentos))
+    return hash_archivo, fragmentos
+
+def fragmentos_por_archivo(textos):
+    """Agrupa los fragmentos (que llegan juntos por archivo) sin cargarlos todos a memoria"""
+    for fuente, docs in groupby(textos, key=lambda doc: doc.metadata.get("source", "desconocido")):
+        yield fuente, ids_de_fragmentos(fuente, list(docs))
+
+def version_del_indice(manifiesto):
+    """
+    Huella del contenido de la base: cambia si cualquier archivo se agrega,
+    se borra o se modifica (y no depende del orden en que se procesaron).
+    """
+    archivos = sorted((fuente, e["hash"]) for fuente, e in (manifiesto or {}).get("archivos", {}).items())
+    return hash_texto(json.dumps(archivos, ensure_ascii=False))
+
+def cargar_manifiesto(persist_directory):
+    ruta = os.path.join(persist_directory, NOMBRE_MANIFIESTO)
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, encoding="utf-8") as f:
+        return json.load(f)
+
+def guardar_manifiesto(persist_directory, manifiesto):
+    # Escribimos a un temporal y luego renombramos, así un corte de luz no deja el manifiesto a medias
+    ruta = os.path.join(persist_directory, NOMBRE_MANIFIESTO)
+    temporal = ruta + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(manifiesto, f, ensure_ascii=False, indent=1)
+    os.replace(temporal, ruta)
+
+def cambios_de_archivo(previo, hash_archivo, fragmentos):
+    """
+    Compara un archivo con lo que dice el manifiesto.
+    Devuelve (fragmentos_nuevos [(id, doc)], ids_a_borrar).
+    """
+    if previo is not None and previo["hash"] == hash_archivo:
+        return [], []  # Archivo sin cambios: ni lo tocamos
+    
+    # Archivo nuevo o modificado: solo se embeben los fragmentos que no existían
+    ids_previos = set(previo["fragmentos"]) if previo else set()
+    ids_actuales = {id_f for id_f, _ in fragmentos}
+    nuevos = [(id_f, doc) for id_f, doc in fragmentos if id_f not in ids_previos]
+    return nuevos, list(ids_previos - ids_actuales)
+
+def abrir_base_vectorial(persist_directory, backend="chroma", embeddings=None, dtype="float32", num_sondas=8):
+    """
+    Abre (o crea vacía) la base vectorial con sus embeddings, sin indexar nada.
+    Devuelve None si falta la API key de OpenAI.
+    
+    Con backend="local" todo funciona sin internet: embeddings locales y un
+    índice propio mapeado a memoria (IndiceVectorialLocal) en lugar de Chroma.
+    Si se pasan `embeddings`, se usan esos en lugar de los de cada backend.
+    
+    Solo para backend="local":
+      dtype       "float32", "float16" o "int8" (se fija al crear el índice)
+      num_sondas  grupos IVF que se revisan por pregunta si hay índice aproximado
+    """
+    if backend == "local":
+        # Nada de APIs: embeddings por hash y nuestro índice en archivos planos
+        db = IndiceVectorialLocal(persist_directory, embeddings or EmbeddingsLocales(), dtype=dtype)
+        db.num_sondas = num_sondas
+        return db
+    if embeddings is not None:
+        return Chroma(persist_directory=persist_directory, embedding_function=embeddings)
     
     # Necesitamos una API key de OpenAI para esto
     # Si no tienes, puedes usar otras alternativas como HuggingFace
     if "OPENAI_API_KEY" not in os.environ:
         print("❌ No se encontró la variable de entorno OPENAI_API_KEY")
         print("💡 Configúrala con: export OPENAI_API_KEY='tu-api-key'")
+        print("💡 O usa el modo sin internet: --backend local")
         return None
     
     # Creamos los embeddings (la magia que convierte texto en vectores)
-    embeddings = OpenAIEmbeddings()
-    
-    # Creamos la base de datos vectorial con Chroma
+    # envueltos en una caché en disco: lo que ya se embebió una vez no se vuelve a pagar,
+    # y lo que falta se manda en lotes paralelos respetando el límite de tokens por minuto
+    embeddings = CacheDeEmbeddings(EmbedderPorLotes(OpenAIEmbeddings()))
     # Es como una biblioteca donde cada libro tiene una coordenada espacial
-    persist_directory = f"./{nombre_db}"
+    return Chroma(persist_directory=persist_directory, embedding_function=embeddings)
+
+def crear_base_vectorial(textos, nombre_db="mi_base_vectorial", tamano_lote=1024, segundos_entre_checkpoints=10,
+                         backend="chroma", embeddings=None, dtype="float32", ivf=False, num_sondas=8):
+    """
+    Aquí convertimos los textos en vectores (números) y los guardamos
+    en una base de datos especial. Es como traducir nuestros documentos
+    al idioma que entienden las máquinas.
+    
+    Si la base ya existe, solo se embeben los fragmentos nuevos o modificados
+    y se borran los de archivos que desaparecieron (gracias al manifiesto).
     
-    # Si ya existe la base de datos, la cargamos
-    if os.path.exists(persist_directory):
+    textos puede ser una lista o un generador de fragmentos, con los de un
+    mismo archivo seguidos (así los entrega cargar_y_procesar_documentos).
+    
+    El manifiesto se guarda cada tanto con los archivos ya terminados, así
+    que si el programa se cae a la mitad, la siguiente corrida sigue donde se quedó.
+    
+    backend: "chroma" (OpenAI) o "local" (sin internet), ver abrir_base_vectorial.
+    Con backend="local", `dtype` y `num_sondas` van a abrir_base_vectorial e ivf=True
+    construye el índice aproximado si aún no existe (después se mantiene solo).
+    """
+    print("🔄 Creando embeddings (traduciendo texto a números)...")
+    
+    # Creamos (o abrimos) la base de datos vectorial
+    persist_directory = os.path.join(".", nombre_db)
+    existia = os.path.exists(persist_directory)
+    db = abrir_base_vectorial(persist_directory, backend, embeddings, dtype, num_sondas)
+    if db is None:
+        return None
+    if isinstance(db, IndiceVectorialLocal) and db.info["dtype"] != dtype:
+        print(f"⚠️ El índice ya existe en {db.info['dtype']}; para usar {dtype} borra '{persist_directory}'")
+    
+    manifiesto = None
+    if existia:
         print("📚 Cargando base de datos existente...")
-        db = Chroma(persist_directory=persist_directory, embedding_function=embeddings)
+        manifiesto = cargar_manifiesto(persist_directory)
+        if manifiesto is None:
+            # Base creada antes de existir el manifiesto: no sabemos qué IDs tiene,
+            # así que la reconstruimos una sola vez para poder actualizarla por partes
+            print("🔁 La base no tiene manifiesto, se reconstruye una vez...")
+            db.delete_collection()
+            db = abrir_base_vectorial(persist_directory, backend, embeddings, dtype, num_sondas)
     else:
-        # Si no, creamos una nueva
         print("🆕 Creando nueva base de datos...")
-        db = Chroma.from_documents(textos, embeddings, persist_directory=persist_directory)
+    
+    # El índice BM25 se actualiza en los mismos lotes que la base vectorial.
+    # Si nunca terminó de llenarse (base anterior a él, o una caída), se rellena
+    # con todos los fragmentos, no solo los nuevos: para eso no hay que embeber nada
+    os.makedirs(persist_directory, exist_ok=True)
+    lexico = IndiceLexico(os.path.join(persist_directory, NOMBRE_LEXICO))
+    if manifiesto is None:
+        lexico.limpiar()
+    rellenar_lexico = not lexico.completo()
+    lote_lexico = []
+    
+    # Vamos archivo por archivo viendo qué cambió desde la última vez,
+    # y embebemos en lotes para que la memoria dependa del lote y no del corpus
+    anteriores = (manifiesto or {}).get("archivos", {})
+    archivos = {}         # Archivos cuyos fragmentos ya están todos en la base
+    en_lote = {}          # Archivos con fragmentos esperando en el lote actual
+    lote_docs, lote_ids = [], []
+    total_nuevos, total_borrados = 0, 0
+    ultimo_checkpoint = time.monotonic()
+    
+    def checkpoint():
+        # Los archivos terminados con su estado nuevo; los demás, como estaban antes
+        parcial = {f: e for f, e in anteriores.items() if f not in archivos and f not in en_lote}
+        parcial.update(archivos)
+        guardar_manifiesto(persist_directory, {"archivos": parcial})
+    
+    # Guardamos el manifiesto desde el principio: así una caída no se confunde con una base vieja
+    checkpoint()
+    
+    def embeber_lote():
+        nonlocal ultimo_checkpoint
+        lexico.agregar(lote_lexico)
+        lote_lexico.clear()
+        if lote_docs:
+            db.add_documents(lote_docs, ids=lote_ids)
+            lote_docs.clear()
+            lote_ids.clear()
+        archivos.update(en_lote)
+        en_lote.clear()
+        if time.monotonic() - ultimo_checkpoint >= segundos_entre_checkpoints:
+            checkpoint()
+            ultimo_checkpoint = time.monotonic()
+    
+    for fuente, (hash_archivo, fragmentos) in fragmentos_por_archivo(textos):
+        entrada = {"hash": hash_archivo, "fragmentos": [id_f for id_f, _ in fragmentos]}
+        nuevos, ids_borrar = cambios_de_archivo(anteriores.get(fuente), hash_archivo, fragmentos)
+        
+        if ids_borrar:
+            db.delete(ids=ids_borrar)
+            lexico.borrar(ids_borrar)
+            total_borrados += len(ids_borrar)
+        
+        lote_lexico.extend(fragmentos if rellenar_lexico else nuevos)
+        for id_f, doc in nuevos:
+            lote_docs.append(doc)
+            lote_ids.append(id_f)
+            if len(lote_docs) >= tamano_lote:
+                embeber_lote()
+        # El archivo cuenta como terminado cuando su último fragmento llegue a la base
+        en_lote[fuente] = entrada
+        total_nuevos += len(nuevos)
+    
+    embeber_lote()
+    
+    # Archivos que ya no existen: se borran sus fragmentos
+    ids_huerfanos = [id_f for fuente, previo in anteriores.items() if fuente not in archivos
+                     for id_f in previo["fragmentos"]]
+    if ids_huerfanos:
+        db.delete(ids=ids_huerfanos)
+        lexico.borrar(ids_huerfanos)
+        total_borrados += len(ids_huerfanos)
+    lexico.marcar_completo()
+    lexico.cerrar()
+    
+    if ivf and isinstance(db, IndiceVectorialLocal) and not db.info["ivf"] and db.info["n"]:
+        print("🗂️ Construyendo índice aproximado (IVF)...")
+        db.construir_ivf()
+    
+    manifiesto_nuevo = {"archivos": archivos}
+    
+    if total_borrados:
+        print(f"🗑️ Se borraron {total_borrados} fragmentos viejos")
+    if total_nuevos:
+        print(f"➕ Se embebieron {total_nuevos} fragmentos nuevos o modificados")
+    
+    if not total_borrados and not total_nuevos:
+        print("✅ Todo está al día, no hubo que embeber nada")
+    else:
+        if hasattr(db, "persist"):
+            db.persist()
         print("💾 Base de datos guardada en disco")
     
+    guardar_manifiesto(persist_directory, manifiesto_nuevo)
+    if isinstance(db.embeddings, CacheDeEmbeddings):
+        print(f"🧠 Caché de embeddings: {db.embeddings.estadisticas()}")
+    
     return db
 
+# =============================================================================
+# PASO 2½: ÍNDICE VECTORIAL LOCAL (FUNCIONA SIN INTERNET)
+# =============================================================================
+
+class EmbeddingsLocales(Embeddings):
+    """
+    Embeddings 100% locales con el "truco del hash": cada palabra y cada trigrama
+    de letras cae en una de `dimension` casillas. No entiende sinónimos como un
+    modelo de verdad, pero es instantáneo, determinista y no necesita internet.
+    """
+    
+    def __init__(self, dimension=512):
+        self.dimension = dimension
+        self.model = f"hash-local-{dimension}"
+    
+    def vector(self, texto):
+        v = np.zeros(self.dimension, dtype=np.float32)
+        for palabra in re.findall(r"\w+", texto.lower()):
+            rasgos = [palabra] + [f"#{palabra}#"[i:i + 3] for i in range(len(palabra))]
+            for rasgo in rasgos:
+                # crc32 es estable entre ejecuciones (hash() de Python no lo es)
+                h = zlib.crc32(rasgo.encode("utf-8"))
+                v[h % self.dimension] += 1.0 if h & 0x80000000 else -1.0
+        norma = np.linalg.norm(v)
+        return (v / norma if norma else v).tolist()
+    
+    def embed_documents(self, texts):
+        return [self.vector(t) for t in texts]
+    
+    def embed_query(self, text):
+        return self.vector(text)
+
+class IndiceVectorialLocal(VectorStore):
+    """
+    Base vectorial que vive en archivos planos de la carpeta:
+    
+      vectores.bin   vectores normalizados (float32, float16 o int8) -> se mapean a memoria
+      escalas.bin    escala de cada vector cuando se guardan en int8
+      vivos.bin      1 si el vector sigue vigente, 0 si se borró
+      textos.jsonl   texto, metadatos e ID de cada vector
+      offsets.bin    en qué byte de textos.jsonl empieza cada renglón
+      centroides.npy + listas.bin   índice aproximado IVF (opcional)
+    
+    Abrirla es casi instantáneo porque los vectores no se leen: se mapean.
+    Al compactar, los archivos nuevos se escriben en una subcarpeta (indice.json
+    dice cuál está vigente), así una caída a la mitad nunca deja el índice vacío.
+    """
+    
+    ARCHIVO_INFO = "indice.json"
+    TIPOS = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+    BLOQUE = 65536  # Filas por bloque en la búsqueda exacta (acota la memoria temporal)
+    
+    def __init__(self, persist_directory, embedding_function, dtype="float32"):
+        self.carpeta = persist_directory
+        self.embedding_function = embedding_function
+        os.makedirs(persist_directory, exist_ok=True)
+        
+        ruta_info = self.ruta(self.ARCHIVO_INFO)
+        if os.path.exists(ruta_info):
+            with open(ruta_info, encoding="utf-8") as f:
+                self.info = json.load(f)
+        else:
+            self.info = {"dim": None, "dtype": dtype, "n": 0, "bytes_textos": 0, "ivf": False}
+        if self.info["n"] == 0:
+            self.info["dtype"] = dtype  # Mientras esté vacío, el tipo todavía se puede elegir
+        self.num_sondas = 8  # Grupos IVF que se revisan por pregunta (si hay índice aproximado)
+        self._ids = None  # Se cargan solo si hace falta (al agregar o borrar)
+        self.mapear()
+    
+    @property
+    def embeddings(self):
+        return self.embedding_function
+    
+    def ruta(self, nombre):
+        if nombre.startswith(self.ARCHIVO_INFO):
+            return os.path.join(self.carpeta, nombre)
+        return os.path.join(self.carpeta, self.info.get("datos", ""), nombre)
+    
+    def borrar_datos(self, subcarpeta=""):
+        """Borra los archivos de datos de una subcarpeta ("" = los de la carpeta misma)"""
+        carpeta = os.path.join(self.carpeta, subcarpeta)
+        if subcarpeta:
+            shutil.rmtree(carpeta, ignore_errors=True)
+            return
+        for nombre in os.listdir(carpeta):
+            if nombre.endswith((".bin", ".jsonl", ".npy")):
+                os.remove(os.path.join(carpeta, nombre))
+    
+    def mapear(self):
+        """(Re)abre los archivos como vistas en memoria, sin leerlos"""
+        n, dim = self.info["n"], self.info["dim"]
+        self.tipo = self.TIPOS[self.info["dtype"]]
+        if n == 0:
+            self.vectores = np.zeros((0, dim or 0), dtype=self.tipo)
+            self.escalas = np.zeros(0, dtype=np.float32)
+            self.offsets = np.zeros(0, dtype=np.int64)
+            self.vivos = np.zeros(0, dtype=bool)
+            self.listas = np.zeros(0, dtype=np.int32)
+            self.centroides = None
+            self._orden_listas = None
+            return
+        
+        self.vectores = np.memmap(self.ruta("vectores.bin"), dtype=self.tipo, mode="r", shape=(n, dim))
+        self.offsets = np.memmap(self.ruta("offsets.bin"), dtype=np.int64, mode="r", shape=(n,))
+        self.escalas = (np.memmap(self.ruta("escalas.bin"), dtype=np.float32, mode="r", shape=(n,))
+                        if self.info["dtype"] == "int8" else None)
+        self.vivos = np.fromfile(self.ruta("vivos.bin"), dtype=np.uint8, count=n).astype(bool)
+        if self.info["ivf"]:
+            self.centroides = np.load(self.ruta("centroides.npy"))
+            self.listas = np.memmap(self.ruta("listas.bin"), dtype=np.int32, mode="r", shape=(n,))
+        else:
+            self.centroides = None
+            self.listas = None
+        self._orden_listas = None
+    
+    def guardar_info(self):
+        temporal = self.ruta(self.ARCHIVO_INFO + ".tmp")
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(self.info, f)
+        os.replace(temporal, self.ruta(self.ARCHIVO_INFO))
+    
+    def escribir_desde(self, nombre, posicion, datos):
+        """Escribe al final "lógico" del archivo (si una caída dejó basura después, se pisa)"""
+        ruta = self.ruta(nombre)
+        with open(ruta, "r+b" if os.path.exists(ruta) else "wb") as f:
+            f.seek(posicion)
+            f.truncate()
+            f.write(datos)
+    
+    @property
+    def ids(self):
+        if self._ids is None:
+            self._ids = []
+            if self.info["n"]:
+                with open(self.ruta("textos.jsonl"), "rb") as f:
+                    for _ in range(self.info["n"]):
+                        self._ids.append(json.loads(f.readline())["id"])
+            self._posiciones = {id_: i for i, id_ in enumerate(self._ids) if self.vivos[i]}
+        return self._ids
+    
+    # ------------------------- escritura -------------------------
+    
+    def cuantizar(self, matriz):
+        """Convierte vectores float32 normalizados al tipo de almacenamiento"""
+        if self.info["dtype"] == "int8":
+            escalas = np.abs(matriz).max(axis=1) / 127
+            escalas[escalas == 0] = 1
+            return np.round(matriz / escalas[:, None]).astype(np.int8), escalas.astype(np.float32)
+        return matriz.astype(self.tipo), None
+    
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = list(ids) if ids is not None else [uuid.uuid4().hex for _ in texts]
+        
+        matriz = np.asarray(self.embedding_function.embed_documents(texts), dtype=np.float32)
+        normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+        matriz = matriz / np.where(normas == 0, 1, normas)
+        
+        if self.info["dim"] is None:
+            self.info["dim"] = matriz.shape[1]
+        
+        # Si un ID ya existía, la versión vieja se marca como borrada (upsert)
+        posiciones = self._mapa_posiciones()
+        existentes = [id_ for id_ in ids if id_ in posiciones]
+        if existentes:
+            self.delete(existentes, compactar=False)
+        
+        n = self.info["n"]
+        datos, escalas = self.cuantizar(matriz)
+        tam_fila = self.info["dim"] * np.dtype(self.tipo).itemsize
+        
+        renglones, offsets, posicion = [], [], self.info["bytes_textos"]
+        for texto, metadata, id_ in zip(texts, metadatas, ids):
+            renglon = (json.dumps({"id": id_, "texto": texto, "metadata": metadata}, ensure_ascii=False) + "\n").encode("utf-8")
+            offsets.append(posicion)
+            posicion += len(renglon)
+            renglones.append(renglon)
+        
+        self.escribir_desde("vectores.bin", n * tam_fila, datos.tobytes())
+        self.escribir_desde("textos.jsonl", self.info["bytes_textos"], b"".join(renglones))
+        self.escribir_desde("offsets.bin", n * 8, np.asarray(offsets, dtype=np.int64).tobytes())
+        self.escribir_desde("vivos.bin", n, np.ones(len(texts), dtype=np.uint8).tobytes())
+        if escalas is not None:
+            self.escribir_desde("escalas.bin", n * 4, escalas.tobytes())
+        if self.info["ivf"]:
+            # Los vectores nuevos se asignan a su centroide más cercano
+            listas = np.argmax(matriz @ self.centroides.T, axis=1).astype(np.int32)
+            self.escribir_desde("listas.bin", n * 4, listas.tobytes())
+        
+        # indice.json se escribe al final: hasta entonces lo nuevo "no existe"
+        self.info["n"] = n + len(texts)
+        self.info["bytes_textos"] = posicion
+        self.guardar_info()
+        
+        if self._ids is not None:
+            for i, id_ in enumerate(ids):
+                self._ids.append(id_)
+                self._posiciones[id_] = n + i
+        self.mapear()
+        return ids
+    
+    def _mapa_posiciones(self):
+        self.ids  # Fuerza la carga perezosa
+        return self._posiciones
+    
+    def delete(self, ids=None, compactar=True, **kwargs):
+        posiciones = self._mapa_posiciones()
+        borrar = [posiciones.pop(id_) for id_ in ids or [] if id_ in posiciones]
+        if not borrar:
+            return True
+        self.vivos[borrar] = False
+        self.escribir_desde("vivos.bin", 0, self.vivos.astype(np.uint8).tobytes())
+        
+        # Si ya hay mucho "hueco", reescribimos los archivos solo con lo vigente
+        if compactar and self.info["n"] and (~self.vivos).sum() > 0.3 * self.info["n"]:
+            self.compactar()
+        return True
+    
+    def compactar(self):
+        """
+        Reescribe los archivos solo con los vectores vigentes.
+        Si había índice IVF se vuelve a construir con el mismo número de grupos.
+        """
+        vigentes = np.nonzero(self.vivos)[0]
+        num_listas = len(self.centroides) if self.info["ivf"] else None
+        print(f"🧹 Compactando índice local ({len(vigentes)} de {self.info['n']} vectores vigentes)...")
+        textos, metadatas, ids = [], [], []
+        with open(self.ruta("textos.jsonl"), "rb") as f:
+            for i in range(self.info["n"]):
+                renglon = f.readline()
+                if self.vivos[i]:
+                    registro = json.loads(renglon)
+                    textos.append(registro["texto"])
+                    metadatas.append(registro["metadata"])
+                    ids.append(registro["id"])
+        vectores = self.vectores_float(vigentes)
+        
+        # Los archivos compactados se arman en una subcarpeta nueva, sin tocar los vigentes
+        generacion = self.info.get("generacion", 0) + 1
+        subcarpeta = f"datos-{generacion}"
+        self.borrar_datos(subcarpeta)  # Restos de una compactación que se cayó
+        nuevo = IndiceVectorialLocal(os.path.join(self.carpeta, subcarpeta),
+                                     _VectoresYaCalculados(vectores), dtype=self.info["dtype"])
+        # Reinsertamos sin volver a embeber: usamos los vectores que ya teníamos
+        nuevo.add_texts(textos, metadatas, ids=ids)
+        if num_listas and nuevo.info["n"]:
+            nuevo.construir_ivf(min(num_listas, nuevo.info["n"]))
+        if os.path.exists(nuevo.ruta(self.ARCHIVO_INFO)):
+            os.remove(nuevo.ruta(self.ARCHIVO_INFO))
+        
+        # indice.json se reemplaza al final (de forma atómica): hasta ese momento
+        # sigue vigente la versión anterior completa
+        anterior = self.info.get("datos", "")
+        self.info = dict(nuevo.info, datos=subcarpeta, generacion=generacion)
+        self.guardar_info()
+        self._ids = None
+        self.mapear()
+        self.borrar_datos(anterior)
+    
+    def delete_collection(self):
+        self.borrar_datos(self.info.pop("datos", ""))
+        self.info.update({"n": 0, "bytes_textos": 0, "ivf": False, "dim": None})
+        self.guardar_info()
+        self._ids = None
+        self.mapear()
+    
+    def persist(self):
+        pass  # Todo se escribe a disco en cuanto se agrega o se borra
+    
+    # ------------------------- índice aproximado -------------------------
+    
+    def construir_ivf(self, num_listas=None, iteraciones=10, muestra=50_000):
+        """
+        Índice aproximado IVF: agrupa los vectores en `num_listas` grupos con k-means.
+        Al buscar solo se revisan los grupos más cercanos a la pregunta.
+        """
+        n = self.info["n"]
+        num_listas = num_listas or max(1, int(np.sqrt(n)))
+        azar = np.random.default_rng(0)
+        idx_muestra = azar.choice(n, size=min(n, muestra), replace=False)
+        datos = self.vectores_float(np.sort(idx_muestra))
+        centroides = datos[azar.choice(len(datos), size=num_listas, replace=False)]
+        
+        for _ in range(iteraciones):
+            asignacion = np.argmax(datos @ centroides.T, axis=1)
+            for c in range(num_listas):
+                miembros = datos[asignacion == c]
+                if len(miembros):
+                    centroides[c] = miembros.mean(axis=0)
+            centroides /= np.maximum(np.linalg.norm(centroides, axis=1, keepdims=True), 1e-12)
+        
+        listas = np.empty(n, dtype=np.int32)
+        for inicio in range(0, n, self.BLOQUE):
+            bloque = self.vectores_float(slice(inicio, inicio + self.BLOQUE))
+            listas[inicio:inicio + self.BLOQUE] = np.argmax(bloque @ centroides.T, axis=1)
+        
+        np.save(self.ruta("centroides.npy"), centroides.astype(np.float32))
+        self.escribir_desde("listas.bin", 0, listas.tobytes())
+        self.info["ivf"] = True
+        self.guardar_info()
+        self.mapear()
+    
+    def candidatos_ivf(self, consulta, num_sondas):
+        """Posiciones de los vectores en los `num_sondas` grupos más cercanos a la consulta"""
+        if self._orden_listas is None:
+            # Ordenamos una vez las posiciones por grupo para sacar cada grupo como una rebanada
+            self._orden_listas = np.argsort(self.listas, kind="stable")
+            self._inicios_listas = np.searchsorted(self.listas[self._orden_listas],
+                                                   np.arange(len(self.centroides) + 1))
+        cercanos = np.argsort(-(self.centroides @ consulta))[:num_sondas]
+        partes = [self._orden_listas[self._inicios_listas[c]:self._inicios_listas[c + 1]] for c in cercanos]
+        return np.sort(np.concatenate(partes)) if partes else np.zeros(0, dtype=np.int64)
+    
+    # ------------------------- búsqueda -------------------------
+    
+    def vectores_float(self, filas):
+        bloque = np.asarray(self.vectores[filas], dtype=np.float32)
+        if self.escalas is not None:
+            bloque *= np.asarray(self.escalas[filas])[:, None]
+        return bloque
+    
+    @staticmethod
+    def mejores(puntajes, posiciones, k):
+        if len(puntajes) > k:
+            elegidos = np.argpartition(-puntajes, k)[:k]
+            return puntajes[elegidos], posiciones[elegidos]
+        return puntajes, posiciones
+    
+    def buscar_por_vector(self, consulta, k=4, aproximado=None, num_sondas=None, filas=None):
+        """
+        Devuelve [(posición, similitud coseno)] de los k vectores más parecidos.
+        Si se dan `filas`, solo se compara contra esas posiciones (prefiltro).
+        """
+        num_sondas = num_sondas or self.num_sondas
+        consulta = np.asarray(consulta, dtype=np.float32)
+        consulta = consulta / (np.linalg.norm(consulta) or 1)
+        n = self.info["n"]
+        if n == 0:
+            return []
+        
+        usar_ivf = self.info["ivf"] if aproximado is None else (aproximado and self.info["ivf"])
+        mejores_p, mejores_pos = np.zeros(0, np.float32), np.zeros(0, np.int64)
+        if filas is not None or usar_ivf:
+            candidatos = (np.unique(np.asarray(filas, dtype=np.int64)) if filas is not None
+                          else self.candidatos_ivf(consulta, num_sondas))
+            candidatos = candidatos[self.vivos[candidatos]]
+            puntajes = self.vectores_float(candidatos) @ consulta
+            mejores_p, mejores_pos = self.mejores(puntajes, candidatos, k)
+        else:
+            # Búsqueda exacta por bloques: producto punto vectorizado contra todo
+            for inicio in range(0, n, self.BLOQUE):
+                fin = min(n, inicio + self.BLOQUE)
+                puntajes = self.vectores_float(slice(inicio, fin)) @ consulta
+                puntajes[~self.vivos[inicio:fin]] = -np.inf
+                p, pos = self.mejores(puntajes, np.arange(inicio, fin), k)
+                mejores_p, mejores_pos = self.mejores(np.concatenate([mejores_p, p]),
+                                                      np.concatenate([mejores_pos, pos]), k)
+        
+        orden = np.argsort(-mejores_p)
+        return [(int(mejores_pos[i]), float(mejores_p[i])) for i in orden if np.isfinite(mejores_p[i])]
+    
+    def leer_registro(self, posicion):
+        with open(self.ruta("textos.jsonl"), "rb") as f:
+            f.seek(int(self.offsets[posicion]))
+            return json.loads(f.readline())
+    
+    def documento(self, posicion):
+        registro = self.leer_registro(posicion)
+        return Document(page_content=registro["texto"], metadata=registro["metadata"])
+    
+    def similarity_search_by_vector_with_score(self, embedding, k=4, **kwargs):
+        return [(self.documento(pos), puntaje) for pos, puntaje in self.buscar_por_vector(embedding, k, **kwargs)]
+    
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector_with_score(self.embedding_function.embed_query(query), k, **kwargs)
+    
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, **kwargs)]
+    
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+    
+    def _select_relevance_score_fn(self):
+        return lambda similitud: similitud
+    
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, persist_directory="./indice_local", **kwargs):
+        indice = cls(persist_directory, embedding, dtype=kwargs.pop("dtype", "float32"))
+        indice.add_texts(texts, metadatas, **kwargs)
+        return indice
+
+class _VectoresYaCalculados:
+    """Embedder de mentira que devuelve vectores ya calculados (para compactar)"""
+    def __init__(self, vectores):
+        self.vectores = vectores
+    
+    def embed_documents(self, texts):
+        return self.vectores
+
+def benchmark_busqueda(num_vectores=100_000, dimension=384, consultas=50, k=10):
+    """
+    Compara la búsqueda exacta (fuerza bruta) contra la aproximada (IVF):
+    latencia por consulta y qué tanto coinciden los resultados (recall@k).
+    """
+    carpeta = tempfile.mkdtemp(prefix="indice_bench_")
+    try:
+        azar = np.random.default_rng(42)
+        # Datos con "temas": vectores agrupados alrededor de unos centros, como texto real
+        centros = azar.normal(size=(200, dimension)).astype(np.float32)
+        datos = centros[azar.integers(0, 200, num_vectores)] + 0.5 * azar.normal(size=(num_vectores, dimension)).astype(np.float32)
+        preguntas = datos[azar.integers(0, num_vectores, consultas)] + 0.1 * azar.normal(size=(consultas, dimension)).astype(np.float32)
+        
+        for dtype in ("float32", "float16", "int8"):
+            ruta = os.path.join(carpeta, dtype)
+            inicio = time.perf_counter()
+            indice = IndiceVectorialLocal(ruta, _VectoresYaCalculados(datos), dtype=dtype)
+            indice.add_texts([""] * num_vectores, ids=[str(i) for i in range(num_vectores)])
+            carga = time.perf_counter() - inicio
+            
+            inicio = time.perf_counter()
+            indice = IndiceVectorialLocal(ruta, None)
+            apertura = time.perf_counter() - inicio
+            
+            inicio = time.perf_counter()
+            exactos = [{p for p, _ in indice.buscar_por_vector(q, k, aproximado=False)} for q in preguntas]
+            t_exacta = (time.perf_counter() - inicio) / consultas
+            
+            indice.construir_ivf()
+            inicio = time.perf_counter()
+            aprox = [{p for p, _ in indice.buscar_por_vector(q, k, aproximado=True)} for q in preguntas]
+            t_aprox = (time.perf_counter() - inicio) / consultas
+            recall = np.mean([len(a & e) / k for a, e in zip(aprox, exactos)])
+            
+            megas = os.path.getsize(os.path.join(ruta, "vectores.bin")) / 1e6
+            print(f"📊 {dtype:>7}: {megas:7.1f} MB  carga {carga:5.2f}s  apertura {apertura * 1000:6.2f} ms  "
+                  f"exacta {t_exacta * 1000:6.2f} ms  IVF {t_aprox * 1000:6.2f} ms  recall@{k} {recall:.2f}")
+    finally:
+        shutil.rmtree(carpeta, ignore_errors=True)
+
+# =============================================================================
+# PASO 2¾: BÚSQUEDA POR PALABRAS (BM25) Y BÚSQUEDA HÍBRIDA
+# =============================================================================
+
+def sin_acentos(texto):
+    """Minúsculas y sin acentos: "Canción" y "cancion" cuentan como lo mismo"""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+def tokens_lexicos(texto):
+    """
+    Corta el texto en palabras para el índice BM25: minúsculas y sin acentos.
+    Los códigos tipo "SKU-4410-B" se guardan enteros y también por partes,
+    así se encuentran tanto con el código completo como con un pedazo.
+    """
+    tokens = []
+    for palabra in re.findall(r"\w+(?:[-./]\w+)*", sin_acentos(texto)):
+        tokens.append(palabra)
+        if not palabra.isalnum():
+            tokens.extend(re.findall(r"[^\W_]+", palabra))
+    return tokens
+
+def clave_documento(doc):
+    """Identifica un fragmento por su fuente y su texto (sirve para cualquier backend)"""
+    return hash_texto(f"{doc.metadata.get('source', '')}\n{doc.page_content}")
+
+class IndiceLexico:
+    """
+    Índice invertido en SQLite: para cada palabra, en qué fragmentos aparece y
+    cuántas veces. Se actualiza por fragmento (agregar/borrar) igual que la base
+    vectorial, así que nunca hay que reconstruirlo completo.
+    """
+    
+    def __init__(self, ruta, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.candado = threading.RLock()  # Se consulta desde varios hilos en el servidor
+        self.conexion = sqlite3.connect(ruta, check_same_thread=False)
+        self.conexion.executescript("""
+            CREATE TABLE IF NOT EXISTS documentos
+                (id TEXT PRIMARY KEY, texto TEXT, metadata TEXT, longitud INTEGER);
+            CREATE TABLE IF NOT EXISTS terminos
+                (termino TEXT, doc_id TEXT, tf INTEGER, PRIMARY KEY (termino, doc_id)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_terminos_doc ON terminos (doc_id);
+            CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT);
+        """)
+        # N y la suma de longitudes (para BM25) se llevan al día en meta; un índice
+        # anterior a eso se cuenta una sola vez aquí
+        if self.estadisticas() is None:
+            n, total = self.conexion.execute(
+                "SELECT COUNT(*), COALESCE(SUM(longitud), 0) FROM documentos"
+            ).fetchone()
+            self.guardar_estadisticas(n, total)
+        self.conexion.commit()
+    
+    def __len__(self):
+        return self.estadisticas()[0]
+    
+    def estadisticas(self):
+        """(número de fragmentos, suma de sus longitudes), o None si aún no se guardaron"""
+        with self.candado:
+            filas = dict(self.conexion.execute(
+                "SELECT clave, valor FROM meta WHERE clave IN ('n_docs', 'longitud_total')"
+            ).fetchall())
+        if len(filas) < 2:
+            return None
+        return int(filas["n_docs"]), int(filas["longitud_total"])
+    
+    def guardar_estadisticas(self, n, total):
+        self.conexion.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                                  [("n_docs", str(n)), ("longitud_total", str(total))])
+    
+    def ajustar_estadisticas(self, delta_n, delta_total):
+        if delta_n or delta_total:
+            n, total = self.estadisticas() or (0, 0)
+            self.guardar_estadisticas(n + delta_n, total + delta_total)
+    
+    def agregar(self, fragmentos):
+        """Agrega (o reemplaza) fragmentos [(id, doc)]"""
+        if not fragmentos:
+            return
+        filas_docs, filas_terminos = [], []
+        for id_f, doc in fragmentos:
+            tokens = tokens_lexicos(doc.page_content)
+            conteo = {}
+            for token in tokens:
+                conteo[token] = conteo.get(token, 0) + 1
+            filas_docs.append((id_f, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False), len(tokens)))
+            filas_terminos.extend((termino, id_f, tf) for termino, tf in conteo.items())
+        with self.candado:
+            self.borrar([id_f for id_f, _ in fragmentos], guardar=False)
+            self.conexion.executemany("INSERT INTO documentos VALUES (?, ?, ?, ?)", filas_docs)
+            self.conexion.executemany("INSERT INTO terminos VALUES (?, ?, ?)", filas_terminos)
+            self.ajustar_estadisticas(len(filas_docs), sum(fila[3] for fila in filas_docs))
+            self.conexion.commit()
+    
+    def borrar(self, ids, guardar=True):
+        ids = list(ids)
+        with self.candado:
+            for i in range(0, len(ids), 500):
+                tanda = ids[i:i + 500]
+                marcas = ",".join("?" * len(tanda))
+                n, total = self.conexion.execute(
+                    f"SELECT COUNT(*), COALESCE(SUM(longitud), 0) FROM documentos WHERE id IN ({marcas})", tanda
+                ).fetchone()
+                self.conexion.execute(f"DELETE FROM terminos WHERE doc_id IN ({marcas})", tanda)
+                self.conexion.execute(f"DELETE FROM documentos WHERE id IN ({marcas})", tanda)
+                self.ajustar_estadisticas(-n, -total)
+            if guardar:
+                self.conexion.commit()
+    
+    def limpiar(self):
+        with self.candado:
+            self.conexion.executescript("DELETE FROM terminos; DELETE FROM documentos; DELETE FROM meta;")
+            self.guardar_estadisticas(0, 0)
+            self.conexion.commit()
+    
+    def completo(self):
+        """¿Terminó alguna vez de indexar todo? (si no, hay que rellenarlo)"""
+        with self.candado:
+            return self.conexion.execute("SELECT 1 FROM meta WHERE clave = 'completo'").fetchone() is not None
+    
+    def marcar_completo(self):
+        with self.candado:
+            self.conexion.execute("INSERT OR REPLACE INTO meta VALUES ('completo', '1')")
+            self.conexion.commit()
+    
+    def cerrar(self):
+        with self.candado:
+            self.conexion.close()
+    
+    def puntajes(self, consulta):
+        """Puntaje BM25 de cada fragmento que comparte al menos una palabra con la consulta"""
+        terminos = list(dict.fromkeys(tokens_lexicos(consulta)))
+        if not terminos:
+            return {}
+        marcas = ",".join("?" * len(terminos))
+        with self.candado:
+            n, total = self.estadisticas() or (0, 0)
+            if not n:
+                return {}
+            apariciones = self.conexion.execute(
+                f"SELECT t.termino, t.doc_id, t.tf, d.longitud FROM terminos t "
+                f"JOIN documentos d ON d.id = t.doc_id WHERE t.termino IN ({marcas})", terminos
+            ).fetchall()
+        promedio = total / n or 1
+        
+        # Palabras raras valen más que palabras comunes (idf)
+        df = {}
+        for termino, *_ in apariciones:
+            df[termino] = df.get(termino, 0) + 1
+        idf = {t: np.log(1 + (n - d + 0.5) / (d + 0.5)) for t, d in df.items()}
+        
+        puntajes = {}
+        for termino, doc_id, tf, longitud in apariciones:
+            norma = self.k1 * (1 - self.b + self.b * longitud / promedio)
+            puntajes[doc_id] = puntajes.get(doc_id, 0.0) + idf[termino] * tf * (self.k1 + 1) / (tf + norma)
+        return puntajes
+    
+    def buscar(self, consulta, k=4):
+        """Devuelve [(id, Document, puntaje)] de los k fragmentos con mejor BM25"""
+        puntajes = self.puntajes(consulta)
+        mejores = sorted(puntajes.items(), key=lambda par: par[1], reverse=True)[:k]
+        if not mejores:
+            return []
+        marcas = ",".join("?" * len(mejores))
+        with self.candado:
+            filas = {id_f: (texto, metadata) for id_f, texto, metadata in self.conexion.execute(
+                f"SELECT id, texto, metadata FROM documentos WHERE id IN ({marcas})", [id_f for id_f, _ in mejores]
+            )}
+        return [(id_f, Document(page_content=filas[id_f][0], metadata=json.loads(filas[id_f][1])), puntaje)
+                for id_f, puntaje in mejores]
+
+class RecuperadorHibrido(BaseRetriever):
+    """
+    Junta dos búsquedas: la vectorial (entiende el sentido) y la BM25 (no se le
+    escapan códigos, nombres ni números exactos). Las combina con "reciprocal
+    rank fusion": cada lista aporta peso / (rrf_k + posición) a cada fragmento.
+    
+    Con prefiltrar=True y el índice local, la búsqueda vectorial solo compara
+    contra los candidatos que encontró BM25 (mucho más barato, pero entonces
+    un fragmento sin ninguna palabra en común con la pregunta no sale).
+    """
+    
+    vectorstore: VectorStore
+    lexico: IndiceLexico
+    k: int = 4
+    k_candidatos: int = 20
+    peso_vectorial: float = 1.0
+    peso_lexico: float = 1.0
+    rrf_k: int = 60
+    prefiltrar: bool = False
+    
+    class Config:
+        arbitrary_types_allowed = True
+    
+    def resultados_vectoriales(self, consulta, candidatos_lexicos):
+        if self.prefiltrar and isinstance(self.vectorstore, IndiceVectorialLocal):
+            posiciones = self.vectorstore._mapa_posiciones()
+            filas = [posiciones[id_f] for id_f, _, _ in candidatos_lexicos if id_f in posiciones]
+            vector = self.vectorstore.embedding_function.embed_query(consulta)
+            return [self.vectorstore.documento(pos)
+                    for pos, _ in self.vectorstore.buscar_por_vector(vector, self.k_candidatos, filas=filas)]
+        return self.vectorstore.similarity_search(consulta, k=self.k_candidatos)
+    
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        lexicos = self.lexico.buscar(query, self.k_candidatos)
+        vectoriales = self.resultados_vectoriales(query, lexicos)
+        
+        fusion = {}
+        for peso, docs in ((self.peso_vectorial, vectoriales), (self.peso_lexico, [doc for _, doc, _ in lexicos])):
+            for posicion, doc in enumerate(docs, start=1):
+                clave = clave_documento(doc)
+                puntaje, _ = fusion.get(clave, (0.0, doc))
+                fusion[clave] = (puntaje + peso / (self.rrf_k + posicion), doc)
+        
+        ordenados = sorted(fusion.values(), key=lambda par: par[0], reverse=True)
+        return [doc for _, doc in ordenados[:self.k]]
+
 # =============================================================================
 # PASO 3: CREAR LA CADENA DE RAG
 # =============================================================================
 
-def crear_cadena_rag(db):
+def solapamiento(anterior, siguiente, minimo=20):
+    """
+    Cuántos caracteres del final de `anterior` son el principio de `siguiente`
+    (lo que repite el chunk_overlap entre dos fragmentos vecinos). 0 si no se tocan.
+    """
+    muestra = siguiente[:minimo]
+    if len(muestra) < min(minimo, len(siguiente)) or not muestra:
+        return 0
+    pos = anterior.find(muestra)
+    while pos != -1:
+        if siguiente.startswith(anterior[pos:]):
+            return len(anterior) - pos
+        pos = anterior.find(muestra, pos + 1)
+    return 0
+
+def unir_fragmentos_vecinos(docs):
+    """
+    Quita fragmentos repetidos o contenidos en otro y une los que son vecinos
+    en el mismo archivo (el final de uno es el principio del otro), sin
+    repetir el pedazo compartido. Conserva el orden del mejor de cada grupo.
+    """
+    unidos = []  # [(texto, doc original del mejor)]
+    for doc in docs:
+        texto = doc.page_content
+        fuente = doc.metadata.get("source")
+        absorbido = False
+        for i, (otro, base) in enumerate(unidos):
+            if base.metadata.get("source") != fuente:
+                continue
+            if texto in otro:
+                absorbido = True
+            elif otro in texto:
+                unidos[i] = (texto, base)
+                absorbido = True
+            elif solapamiento(otro, texto):
+                unidos[i] = (otro + texto[solapamiento(otro, texto):], base)
+                absorbido = True
+            elif solapamiento(texto, otro):
+                unidos[i] = (texto + otro[solapamiento(texto, otro):], base)
+                absorbido = True
+            if absorbido:
+                break
+        if not absorbido:
+            unidos.append((texto, doc))
+    
+    # Al crecer, un bloque puede tocar a otro que ya estaba: repetimos hasta que no cambie nada
+    resultado = [Document(page_content=texto, metadata=base.metadata) for texto, base in unidos]
+    return resultado if len(resultado) == len(docs) else unir_fragmentos_vecinos(resultado)
+
+def mmr(vector_consulta, vectores, k, lambda_mmr=0.5):
+    """
+    Maximal Marginal Relevance: elige k fragmentos que se parezcan a la
+    pregunta pero no tanto entre sí (menos información repetida en el contexto).
+    Devuelve los índices elegidos, en orden.
+    """
+    consulta = np.asarray(vector_consulta, dtype=np.float32)
+    matriz = np.asarray(vectores, dtype=np.float32)
+    consulta /= np.linalg.norm(consulta) or 1
+    matriz /= np.maximum(np.linalg.norm(matriz, axis=1, keepdims=True), 1e-12)
+    
+    relevancia = matriz @ consulta
+    elegidos = [int(np.argmax(relevancia))]
+    parecido_max = matriz @ matriz[elegidos[0]]
+    while len(elegidos) < min(k, len(matriz)):
+        puntaje = lambda_mmr * relevancia - (1 - lambda_mmr) * parecido_max
+        puntaje[elegidos] = -np.inf
+        siguiente = int(np.argmax(puntaje))
+        elegidos.append(siguiente)
+        parecido_max = np.maximum(parecido_max, matriz @ matriz[siguiente])
+    return elegidos
+
+def empaquetar_contexto(docs, max_tokens=1200):
+    """
+    Mete los fragmentos (ya ordenados por relevancia) en un presupuesto de
+    tokens: los que no caben se saltan y se prueba con los siguientes. Si ni
+    el primero cabe, se recorta para no mandar el contexto vacío.
+    """
+    empacados, usados = [], 0
+    for doc in docs:
+        tokens = estimar_tokens(doc.page_content)
+        if usados + tokens <= max_tokens:
+            empacados.append(doc)
+            usados += tokens
+    if not empacados and docs:
+        empacados = [Document(page_content=docs[0].page_content[:max_tokens * 4], metadata=docs[0].metadata)]
+    return empacados
+
+class RecuperadorEmpaquetado(BaseRetriever):
+    """
+    Envuelve a otro recuperador y limpia lo que devuelve antes de que llegue
+    al prompt: quita duplicados, une fragmentos vecinos, reordena con MMR
+    (opcional) y recorta todo a `max_tokens`. Menos tokens repetidos en el
+    prompt = respuestas más rápidas y baratas.
+    """
+    
+    base: BaseRetriever
+    max_tokens: int = 1200
+    usar_mmr: bool = False
+    embeddings: Embeddings = None  # Solo hace falta para MMR
+    lambda_mmr: float = 0.5
+    
+    class Config:
+        arbitrary_types_allowed = True
+    
+    def procesar(self, consulta, docs):
+        # Primero quitamos repetidos exactos (pasa mucho en la búsqueda híbrida),
+        # dejando cada uno en su primera aparición: la de mejor posición
+        vistos, unicos = set(), []
+        for doc in docs:
+            clave = clave_documento(doc)
+            if clave not in vistos:
+                vistos.add(clave)
+                unicos.append(doc)
+        docs = unicos
+        if self.usar_mmr and self.embeddings is not None and len(docs) > 1:
+            vectores = self.embeddings.embed_documents([doc.page_content for doc in docs])
+            docs = [docs[i] for i in mmr(self.embeddings.embed_query(consulta), vectores, len(docs), self.lambda_mmr)]
+        return empaquetar_contexto(unir_fragmentos_vecinos(docs), self.max_tokens)
+    
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return self.procesar(query, self.base.get_relevant_documents(query))
+
+def crear_recuperador(db, lexico=None, k=8, peso_vectorial=1.0, peso_lexico=1.0, prefiltrar=False,
+                      max_tokens_contexto=1200, usar_mmr=False):
+    """
+    El recuperador que busca en nuestra base de datos.
+    
+    Si se pasa el índice léxico, la recuperación es híbrida (vectores + BM25);
+    los pesos dicen cuánto cuenta cada una al fusionar.
+    
+    Se recuperan k candidatos y luego se depuran (sin duplicados, vecinos unidos,
+    MMR opcional) hasta caber en max_tokens_contexto antes de ir al prompt.
+    """
+    if lexico is not None:
+        retriever = RecuperadorHibrido(vectorstore=db, lexico=lexico, k=k, peso_vectorial=peso_vectorial,
+                                       peso_lexico=peso_lexico, prefiltrar=prefiltrar)
+    else:
+        retriever = db.as_retriever(search_kwargs={"k": k})
+    return RecuperadorEmpaquetado(base=retriever, max_tokens=max_tokens_contexto,
+                                  usar_mmr=usar_mmr, embeddings=db.embeddings)
+
+def crear_cadena_rag(db, lexico=None, num_sondas=None, **opciones):
     """
     Aquí creamos la cadena que une todo: recuperación de información + generación de respuesta
     Es como conectar el cerebro (base de datos) con la boca (modelo de lenguaje)
+    
+    Las opciones (k, pesos, presupuesto de tokens, MMR...) van a crear_recuperador.
+    num_sondas ajusta la búsqueda aproximada del índice local (más = más exacta).
     """
     print("🔗 Creando cadena RAG...")
+    if num_sondas and isinstance(db, IndiceVectorialLocal):
+        db.num_sondas = num_sondas
     
     # Usamos el modelo de lenguaje de OpenAI
     # Puedes cambiarlo por otro si quieres
     llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0)
     
+    retriever = crear_recuperador(db, lexico, **opciones)
+    
     # Creamos la cadena de RetrievalQA
     # Esto hace que el modelo busque en nuestra base de datos antes de responder
     qa_chain = RetrievalQA.from_chain_type(
         llm=llm,
         chain_type="stuff",  # "Stuff" significa que mete toda la info relevante en el contexto
-        retriever=db.as_retriever()  # El recuperador que busca en nuestra base de datos
+        retriever=retriever
     )
     
     print("✅ Cadena RAG lista para usar")
@@ -121,40 +1448,480 @@ def crear_cadena_rag(db):
 # PASO 4: INTERFAZ DE CHAT
 # =============================================================================
 
-def chatear_con_rag(qa_chain):
+class CacheDePreguntas:
+    """
+    Caché de respuestas en dos niveles, guardada en SQLite:
+    
+      1. Exacta: la misma pregunta normalizada ("¿Qué es X?" == "que es x")
+      2. Semántica: una pregunta distinta pero con embedding casi igual
+         (similitud coseno >= umbral) reutiliza la respuesta, solo si los
+         números y códigos de las dos preguntas son exactamente los mismos
+         ("SKU-4410-B" y "SKU-4410-C" se parecen mucho pero no son lo mismo)
+    
+    Cada respuesta queda atada a la versión del índice con la que se generó:
+    si los documentos cambian, las respuestas viejas dejan de servir solas.
+    """
+    
+    def __init__(self, embeddings, version, ruta="./cache_preguntas.sqlite", umbral=0.95, max_entradas=5000):
+        self.embeddings = embeddings
+        self.version = version
+        self.umbral = umbral
+        self.max_entradas = max_entradas
+        self.modelo = (getattr(embeddings, "modelo", None) or getattr(embeddings, "model", None)
+                       or type(embeddings).__name__)
+        self.aciertos_exactos = 0
+        self.aciertos_semanticos = 0
+        self.fallos = 0
+        self.candado = threading.RLock()  # La comparten todas las peticiones del servidor
+        self.conexion = sqlite3.connect(ruta, check_same_thread=False)
+        self.conexion.execute(
+            "CREATE TABLE IF NOT EXISTS preguntas "
+            "(clave TEXT PRIMARY KEY, respuesta TEXT, vector BLOB, modelo TEXT, version TEXT, ultimo_uso REAL, "
+            "identificadores TEXT)"
+        )
+        columnas = {fila[1] for fila in self.conexion.execute("PRAGMA table_info(preguntas)")}
+        if "identificadores" not in columnas:
+            # Caché anterior: sus filas (sin identificadores) solo sirven como coincidencia exacta
+            self.conexion.execute("ALTER TABLE preguntas ADD COLUMN identificadores TEXT")
+        # Lo generado con otra versión del índice (u otro modelo de embeddings) ya no vale
+        self.conexion.execute("DELETE FROM preguntas WHERE version != ? OR modelo != ?", (version, self.modelo))
+        self.conexion.commit()
+        
+        # Los vectores viven en memoria como una matriz: buscar el más parecido es un solo producto
+        filas = self.conexion.execute("SELECT clave, vector, identificadores FROM preguntas").fetchall()
+        self.claves = [clave for clave, _, _ in filas]
+        self.identificadores = [ids for _, _, ids in filas]
+        self.matriz = (np.stack([np.frombuffer(blob, dtype=np.float32) for _, blob, _ in filas])
+                       if filas else None)
+    
+    @staticmethod
+    def normalizar(pregunta):
+        return " ".join(re.findall(r"\w+", sin_acentos(pregunta)))
+    
+    @staticmethod
+    def identificadores_de(pregunta):
+        """Números y códigos de la pregunta (tokens con dígitos o guiones), en forma canónica"""
+        return " ".join(sorted({t for t in tokens_lexicos(pregunta)
+                                if "-" in t or any(c.isdigit() for c in t)}))
+    
+    def vector(self, pregunta):
+        v = np.asarray(self.embeddings.embed_query(pregunta), dtype=np.float32)
+        return v / (np.linalg.norm(v) or 1)
+    
+    def usar(self, clave):
+        with self.candado:
+            fila = self.conexion.execute("SELECT respuesta FROM preguntas WHERE clave = ?", (clave,)).fetchone()
+            if fila is None:
+                return None
+            self.conexion.execute("UPDATE preguntas SET ultimo_uso = ? WHERE clave = ?", (time.time(), clave))
+            self.conexion.commit()
+            return fila[0]
+    
+    def buscar(self, pregunta):
+        """Devuelve (respuesta, "exacta" | "semántica") o None si hay que preguntarle al modelo"""
+        clave = hash_texto(self.normalizar(pregunta))
+        respuesta = self.usar(clave)
+        if respuesta is not None:
+            self.aciertos_exactos += 1
+            return respuesta, "exacta"
+        
+        if self.matriz is not None and self.umbral < 1:
+            vector = self.vector(pregunta)  # Fuera del candado: puede ser una llamada a la API
+            identificadores = self.identificadores_de(pregunta)
+            with self.candado:
+                similitudes = self.matriz @ vector
+                # La más parecida entre las que hablan de los mismos números y códigos
+                clave_mejor = None
+                for i in np.argsort(-similitudes):
+                    if similitudes[i] < self.umbral:
+                        break
+                    if self.identificadores[i] == identificadores:
+                        clave_mejor = self.claves[i]
+                        break
+            if clave_mejor is not None:
+                respuesta = self.usar(clave_mejor)
+                if respuesta is not None:
+                    self.aciertos_semanticos += 1
+                    return respuesta, "semántica"
+        
+        self.fallos += 1
+        return None
+    
+    def guardar(self, pregunta, respuesta):
+        clave = hash_texto(self.normalizar(pregunta))
+        vector = self.vector(pregunta)
+        identificadores = self.identificadores_de(pregunta)
+        with self.candado:
+            self.conexion.execute(
+                "INSERT OR REPLACE INTO preguntas "
+                "(clave, respuesta, vector, modelo, version, ultimo_uso, identificadores) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (clave, respuesta, vector.tobytes(), self.modelo, self.version, time.time(), identificadores)
+            )
+            if clave not in self.claves:
+                self.claves.append(clave)
+                self.identificadores.append(identificadores)
+                self.matriz = vector[None, :] if self.matriz is None else np.vstack([self.matriz, vector])
+            self.limpiar()
+            self.conexion.commit()
+    
+    def limpiar(self):
+        """Si la caché pasa del límite, borra las preguntas usadas hace más tiempo"""
+        sobran = len(self.claves) - self.max_entradas
+        if sobran <= 0:
+            return
+        viejas = {clave for clave, in self.conexion.execute(
+            "SELECT clave FROM preguntas ORDER BY ultimo_uso LIMIT ?", (sobran,)
+        )}
+        self.conexion.executemany("DELETE FROM preguntas WHERE clave = ?", [(c,) for c in viejas])
+        quedan = [i for i, clave in enumerate(self.claves) if clave not in viejas]
+        self.claves = [self.claves[i] for i in quedan]
+        self.identificadores = [self.identificadores[i] for i in quedan]
+        self.matriz = self.matriz[quedan] if quedan else None
+    
+    def estadisticas(self):
+        total = self.aciertos_exactos + self.aciertos_semanticos + self.fallos
+        tasa = (total - self.fallos) / total * 100 if total else 0
+        return (f"{self.aciertos_exactos} exactas, {self.aciertos_semanticos} semánticas, "
+                f"{self.fallos} al modelo ({tasa:.0f}% desde caché)")
+
+def chatear_con_rag(servicio):
     """
     Esta es la parte divertida: hablamos con nuestra IA personalizada
+    
+    La respuesta se imprime token por token conforme el modelo la escribe
+    (con el mismo ServicioRAG que usa el servidor). Si el servicio tiene una
+    CacheDePreguntas, las preguntas repetidas (o casi iguales) se contestan
+    sin volver a buscar ni a llamar al modelo.
     """
     print("\n🤖 ¡Hola! Soy tu asistente RAG. Pregúntame lo que quieras sobre tus documentos.")
     print("💡 Escribe 'salir' cuando termines de charlar.\n")
     
-    while True:
-        # Pedimos al usuario que escriba su pregunta
-        pregunta = input("👤 Tú: ")
+    cache = servicio.cache
+    
+    async def imprimir_en_stream(pregunta):
+        partes = []
+        async for trozo in servicio.generar_en_stream(pregunta):
+            print(trozo, end="", flush=True)
+            partes.append(trozo)
+        return "".join(partes)
+    
+    # Un solo event loop para toda la charla (el semáforo del servicio vive en él)
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            # Pedimos al usuario que escriba su pregunta
+            pregunta = input("👤 Tú: ")
+            
+            # Si el usuario quiere salir, nos despedimos
+            if pregunta.lower() == "salir":
+                if cache is not None:
+                    print(f"🧠 Caché de preguntas: {cache.estadisticas()}")
+                print("👋 ¡Hasta luego! Fue un placer ayudarte.")
+                break
+            
+            # Si no hay pregunta, seguimos esperando
+            if not pregunta.strip():
+                continue
+            
+            # Primero vemos si ya contestamos algo igual (o casi igual) antes
+            encontrada = cache.buscar(pregunta) if cache is not None else None
+            if encontrada is not None:
+                respuesta, tipo = encontrada
+                print(f"⚡ (respuesta de la caché, coincidencia {tipo})")
+                print(f"🤖 Asistente: {respuesta}\n")
+                continue
+            
+            # Procesamos la pregunta y mostramos la respuesta conforme llega
+            print("🤔 Pensando...")
+            print("🤖 Asistente: ", end="", flush=True)
+            respuesta = loop.run_until_complete(imprimir_en_stream(pregunta))
+            print("\n")
+            if cache is not None:
+                cache.guardar(pregunta, respuesta)
+    finally:
+        loop.close()
+
+# =============================================================================
+# PASO 4½: SERVICIO ASÍNCRONO Y SERVIDOR HTTP (MUCHOS USUARIOS A LA VEZ)
+# =============================================================================
+
+class ServicioRAG:
+    """
+    Versión asíncrona de la cadena RAG, pensada para atender muchas preguntas
+    a la vez sobre UN solo índice cargado:
+    
+      - La recuperación (SQLite + numpy/Chroma) corre en un pool de hilos, así
+        las búsquedas de varias preguntas se hacen al mismo tiempo
+      - La respuesta del modelo llega token por token (responder_en_stream)
+      - Un semáforo limita cuántas llamadas al modelo hay en vuelo
+    """
+    
+    def __init__(self, db, lexico=None, cache=None, llm=None, hilos=8, max_llamadas=16, **opciones):
+        self.db = db
+        self.cache = cache
+        self.retriever = crear_recuperador(db, lexico, **opciones)
+        self.llm = llm or ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0, streaming=True)
+        self.prompt = PROMPT_SELECTOR.get_prompt(self.llm)  # El mismo prompt que la cadena "stuff"
+        self.hilos = ThreadPoolExecutor(max_workers=hilos)
+        self.max_llamadas = max_llamadas
+        self._semaforo = None  # Se crea dentro del event loop que lo vaya a usar
+    
+    async def en_hilo(self, funcion, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.hilos, funcion, *args)
+    
+    async def recuperar(self, pregunta):
+        return await self.en_hilo(self.retriever.get_relevant_documents, pregunta)
+    
+    async def responder_en_stream(self, pregunta):
+        """Generador asíncrono con los pedazos de la respuesta, conforme los escribe el modelo"""
+        if self.cache is not None:
+            encontrada = await self.en_hilo(self.cache.buscar, pregunta)
+            if encontrada is not None:
+                yield encontrada[0]
+                return
         
-        # Si el usuario quiere salir, nos despedimos
-        if pregunta.lower() == "salir":
-            print("👋 ¡Hasta luego! Fue un placer ayudarte.")
-            break
+        partes = []
+        async for trozo in self.generar_en_stream(pregunta):
+            partes.append(trozo)
+            yield trozo
         
-        # Si no hay pregunta, seguimos esperando
-        if not pregunta.strip():
-            continue
+        if self.cache is not None:
+            await self.en_hilo(self.cache.guardar, pregunta, "".join(partes))
+    
+    async def generar_en_stream(self, pregunta):
+        """Busca el contexto y pide la respuesta al modelo, sin pasar por la caché"""
+        docs = await self.recuperar(pregunta)
+        mensajes = self.prompt.format_messages(
+            context="\n\n".join(doc.page_content for doc in docs), question=pregunta
+        )
         
-        # Procesamos la pregunta con nuestra cadena RAG
-        print("🤔 Pensando...")
-        respuesta = qa_chain.run(pregunta)
+        if self._semaforo is None:
+            self._semaforo = asyncio.Semaphore(self.max_llamadas)
+        async with self._semaforo:
+            async for trozo in self.llm.astream(mensajes):
+                if trozo.content:
+                    yield trozo.content
+    
+    async def responder(self, pregunta):
+        return "".join([trozo async for trozo in self.responder_en_stream(pregunta)])
+    
+    async def responder_varias(self, preguntas):
+        """Contesta varias preguntas a la vez (sus búsquedas y llamadas se traslapan)"""
+        return await asyncio.gather(*(self.responder(p) for p in preguntas))
+    
+    def cerrar(self):
+        self.hilos.shutdown(wait=False)
+
+# Un servicio por (base, backend) y por proceso: el índice se carga una sola vez
+# y todas las sesiones/peticiones lo comparten
+_SERVICIOS = {}
+_CANDADO_SERVICIOS = threading.Lock()
+
+def obtener_servicio(nombre_db="mi_base_vectorial", backend="chroma", num_sondas=8, **opciones):
+    """Devuelve el ServicioRAG de esa base, abriéndola solo la primera vez"""
+    with _CANDADO_SERVICIOS:
+        clave = (nombre_db, backend)
+        if clave not in _SERVICIOS:
+            persist_directory = os.path.join(".", nombre_db)
+            db = abrir_base_vectorial(persist_directory, backend, num_sondas=num_sondas)
+            if db is None:
+                return None
+            lexico = IndiceLexico(os.path.join(persist_directory, NOMBRE_LEXICO))
+            version = version_del_indice(cargar_manifiesto(persist_directory))
+            cache = CacheDePreguntas(db.embeddings, version,
+                                     ruta=os.path.join(persist_directory, "cache_preguntas.sqlite"))
+            _SERVICIOS[clave] = ServicioRAG(db, lexico, cache, **opciones)
+        return _SERVICIOS[clave]
+
+def crear_app(servicio):
+    """
+    App HTTP (aiohttp) sobre un ServicioRAG:
+    
+      POST /preguntar  {"pregunta": "...", "stream": true}
+          stream=false -> {"respuesta": "..."}
+          stream=true  -> Server-Sent Events: data: {"token": "..."} ... data: [DONE]
+      GET /salud       -> {"ok": true}
+    """
+    if web is None:
+        raise ImportError("El servidor necesita aiohttp: pip install aiohttp")
+    
+    async def preguntar(request):
+        try:
+            cuerpo = await request.json()
+            if not isinstance(cuerpo, dict):
+                raise ValueError("el cuerpo no es un objeto JSON")
+            pregunta = str(cuerpo["pregunta"]).strip()
+        except (ValueError, KeyError):
+            return web.json_response({"error": "Se esperaba JSON con el campo 'pregunta'"}, status=400)
+        if not pregunta:
+            return web.json_response({"error": "La pregunta está vacía"}, status=400)
+        
+        if not cuerpo.get("stream"):
+            return web.json_response({"respuesta": await servicio.responder(pregunta)})
+        
+        respuesta = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await respuesta.prepare(request)
+        async for trozo in servicio.responder_en_stream(pregunta):
+            await respuesta.write(f"data: {json.dumps({'token': trozo}, ensure_ascii=False)}\n\n".encode("utf-8"))
+        await respuesta.write(b"data: [DONE]\n\n")
+        await respuesta.write_eof()
+        return respuesta
+    
+    async def salud(request):
+        return web.json_response({"ok": True})
+    
+    app = web.Application()
+    app.router.add_post("/preguntar", preguntar)
+    app.router.add_get("/salud", salud)
+    return app
+
+def servir(servicio, host="127.0.0.1", puerto=8000):
+    print(f"🌐 Servidor RAG escuchando en http://{host}:{puerto}  (POST /preguntar)")
+    web.run_app(crear_app(servicio), host=host, port=puerto, print=None)
+
+# =============================================================================
+# PASO 5: BANCO DE PRUEBAS DEL RAG COMPLETO
+# =============================================================================
+
+class _EmbedderContado(Embeddings):
+    """Envuelve un embedder y cuenta cuántas llamadas y textos le llegan"""
+    
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.model = getattr(embeddings, "model", None) or type(embeddings).__name__
+        self.llamadas = 0
+        self.textos = 0
+        self.candado = threading.Lock()
+    
+    def embed_documents(self, texts):
+        with self.candado:
+            self.llamadas += 1
+            self.textos += len(texts)
+        return self.embeddings.embed_documents(texts)
+    
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+def generar_corpus_sintetico(carpeta, num_archivos=200, parrafos_por_archivo=20, semilla=7):
+    """
+    Escribe un corpus de prueba con "respuestas conocidas": cada archivo trae
+    escondido un dato único (el código de un producto) entre párrafos de relleno.
+    Devuelve [(pregunta, dato que debe aparecer en lo recuperado)].
+    """
+    azar = random.Random(semilla)
+    vocabulario = ("casa perro proyecto sistema datos cliente factura envío almacén precio calidad "
+                   "equipo reunión informe servidor usuario pedido garantía manual proveedor").split()
+    preguntas = []
+    for i in range(num_archivos):
+        subcarpeta = os.path.join(carpeta, f"tema_{i % 10}")
+        os.makedirs(subcarpeta, exist_ok=True)
+        codigo = f"SKU-{azar.randrange(10**6):06d}-{azar.choice('ABCDEFGH')}"
+        dato = f"El código del producto número {i} es {codigo}."
+        parrafos = [" ".join(azar.choices(vocabulario, k=60)) + "." for _ in range(parrafos_por_archivo)]
+        parrafos.insert(azar.randrange(len(parrafos) + 1), dato)
+        with open(os.path.join(subcarpeta, f"producto_{i}.txt"), "w", encoding="utf-8") as f:
+            f.write("\n\n".join(parrafos))
+        preguntas.append((f"¿Cuál es el código del producto número {i}?", codigo))
+    return preguntas
+
+def percentiles(valores):
+    p50, p95, p99 = np.percentile(valores, [50, 95, 99]) if valores else (0, 0, 0)
+    return f"p50 {p50 * 1000:6.2f} ms  p95 {p95 * 1000:6.2f} ms  p99 {p99 * 1000:6.2f} ms"
+
+def pico_memoria_mb():
+    """Pico de memoria residente del proceso (y de los procesos hijos de la ingesta)"""
+    if resource is None:
+        return float("nan")
+    propio = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    hijos = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024  # Mac lo da en bytes, Linux en KB
+    return max(propio, hijos) / divisor
+
+def tamano_en_disco_mb(carpeta):
+    return sum(os.path.getsize(os.path.join(raiz, archivo))
+               for raiz, _, archivos in os.walk(carpeta) for archivo in archivos) / 1e6
+
+def benchmark_rag(num_archivos=200, chunk_sizes=(500, 1000), backends=("local",), con_cache=(False, True),
+                  consultas=100, k=4):
+    """
+    Corre el camino completo (cargar_y_procesar_documentos -> crear_base_vectorial
+    -> recuperación) sobre un corpus sintético con un embedder local determinista
+    y reporta, para cada combinación de tamaño de fragmento, backend y caché:
+    
+      - ingesta: tiempo, fragmentos/s, llamadas al embedder, tamaño en disco
+      - reconstrucción desde cero (aquí se nota la caché de embeddings)
+      - consultas: latencia p50/p95/p99 y recall@k (vectorial, BM25 e híbrida)
+      - pico de memoria del proceso
+    """
+    carpeta = tempfile.mkdtemp(prefix="bench_rag_")
+    try:
+        ruta_corpus = os.path.join(carpeta, "corpus")
+        preguntas = generar_corpus_sintetico(ruta_corpus, num_archivos)
+        preguntas = random.Random(0).sample(preguntas, min(consultas, len(preguntas)))
+        print(f"📊 Corpus sintético: {num_archivos} archivos, {tamano_en_disco_mb(ruta_corpus):.1f} MB, "
+              f"{len(preguntas)} preguntas con respuesta conocida\n")
         
-        # Mostramos la respuesta
-        print(f"🤖 Asistente: {respuesta}\n")
+        for chunk_size in chunk_sizes:
+            for backend in backends:
+                for usar_cache in con_cache:
+                    nombre = f"{backend}-{chunk_size}-{'cache' if usar_cache else 'sin_cache'}"
+                    contado = _EmbedderContado(EmbeddingsLocales())
+                    embeddings = (CacheDeEmbeddings(contado, ruta=os.path.join(carpeta, f"{nombre}.sqlite"))
+                                  if usar_cache else contado)
+                    
+                    # Ingesta en frío y luego reconstrucción desde cero con la misma caché
+                    tiempos = []
+                    try:
+                        for corrida in ("fria", "reconstruida"):
+                            ruta_db = os.path.join(carpeta, f"{nombre}-{corrida}")
+                            llamadas_antes = contado.textos
+                            inicio = time.perf_counter()
+                            textos = cargar_y_procesar_documentos(ruta_corpus, chunk_size=chunk_size,
+                                                                  chunk_overlap=chunk_size // 10)
+                            db = crear_base_vectorial(textos, nombre_db=ruta_db, backend=backend,
+                                                      embeddings=embeddings)
+                            tiempos.append((time.perf_counter() - inicio, contado.textos - llamadas_antes))
+                    except ImportError as e:
+                        print(f"⏭️ {nombre}: se omite ({e})\n")
+                        continue
+                    
+                    fragmentos = sum(len(e["fragmentos"]) for e in cargar_manifiesto(ruta_db)["archivos"].values())
+                    lexico = IndiceLexico(os.path.join(ruta_db, NOMBRE_LEXICO))
+                    modos = {
+                        "vectorial": lambda p: db.similarity_search(p, k=k),
+                        "bm25": lambda p: [doc for _, doc, _ in lexico.buscar(p, k)],
+                        "híbrida": RecuperadorHibrido(vectorstore=db, lexico=lexico, k=k).get_relevant_documents,
+                    }
+                    resultados = {}
+                    for modo, buscar in modos.items():
+                        latencias, aciertos = [], 0
+                        for pregunta, dato in preguntas:
+                            inicio = time.perf_counter()
+                            docs = buscar(pregunta)
+                            latencias.append(time.perf_counter() - inicio)
+                            aciertos += any(dato in doc.page_content for doc in docs)
+                        resultados[modo] = (latencias, aciertos / len(preguntas))
+                    lexico.cerrar()
+                    
+                    (t_fria, textos_frios), (t_recons, textos_recons) = tiempos
+                    print(f"\n🧪 {nombre}")
+                    print(f"   ingesta:        {t_fria:6.2f}s  {fragmentos / t_fria:8.1f} fragmentos/s  "
+                          f"{textos_frios} textos embebidos  {tamano_en_disco_mb(ruta_db):6.1f} MB en disco")
+                    print(f"   reconstrucción: {t_recons:6.2f}s  {textos_recons} textos embebidos")
+                    for modo, (latencias, recall) in resultados.items():
+                        print(f"   {modo:<10} {percentiles(latencias)}  recall@{k} {recall:.2f}")
+                    print(f"   pico de memoria: {pico_memoria_mb():.0f} MB\n")
+    finally:
+        shutil.rmtree(carpeta, ignore_errors=True)
 
 # =============================================================================
 # FUNCIÓN PRINCIPAL - Donde todo se junta
 # =============================================================================
 
-def main():
+def main(backend="chroma", servir_http=False, puerto=8000, dtype="float32", ivf=False, num_sondas=8):
     """
     Esta es la función principal que orquesta todo el proceso
+    (dtype, ivf y num_sondas solo aplican al backend local)
     """
     print("=" * 50)
     print("🚀 SISTEMA RAG BÁSICO - Tu IA personalizada")
@@ -175,24 +1942,70 @@ def main():
     if textos is None:
         return
     
-    # Paso 2: Crear base de datos vectorial
-    db = crear_base_vectorial(textos)
+    # Paso 2: Crear base de datos vectorial (y su índice de palabras)
+    nombre_db = "mi_base_vectorial"
+    db = crear_base_vectorial(textos, nombre_db=nombre_db, backend=backend,
+                              dtype=dtype, ivf=ivf, num_sondas=num_sondas)
     
     if db is None:
         return
     
-    # Paso 3: Crear cadena RAG
-    qa_chain = crear_cadena_rag(db)
+    # Paso 3: Servicio RAG con búsqueda híbrida y caché de preguntas atada a la
+    # versión actual del índice (un solo índice cargado para todos los usuarios)
+    servicio = obtener_servicio(nombre_db, backend, num_sondas=num_sondas)
+    
+    if servicio is None:
+        return
     
-    if qa_chain is None:
+    # Modo servidor
+    if servir_http:
+        servir(servicio, puerto=puerto)
         return
     
-    # Paso 4: Iniciar el chat
-    chatear_con_rag(qa_chain)
+    # Paso 4: Iniciar el chat (la respuesta se imprime conforme llega)
+    chatear_con_rag(servicio)
 
 # =============================================================================
 # EJECUTAMOS EL PROGRAMA
 # =============================================================================
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Sistema RAG básico")
+    parser.add_argument("--bench-ingesta", action="store_true",
+                        help="Mide la velocidad de carga y división sobre un corpus sintético")
+    parser.add_argument("--archivos", type=int, default=400, help="Archivos del corpus sintético")
+    parser.add_argument("--bench-busqueda", action="store_true",
+                        help="Compara la búsqueda exacta contra la aproximada (IVF) del índice local")
+    parser.add_argument("--backend", choices=["chroma", "local"], default="chroma",
+                        help="'local' usa embeddings e índice propios, sin internet")
+    parser.add_argument("--dtype", choices=["float32", "float16", "int8"], default="float32",
+                        help="Con --backend local: cómo se guardan los vectores (int8 ocupa 4 veces menos)")
+    parser.add_argument("--ivf", action="store_true",
+                        help="Con --backend local: construye el índice aproximado (IVF) para buscar más rápido")
+    parser.add_argument("--sondas", type=int, default=8,
+                        help="Con --backend local e --ivf: grupos que se revisan por pregunta (más = más exacto)")
+    parser.add_argument("--bench-rag", action="store_true",
+                        help="Mide ingesta, tamaño, latencia y recall@k del RAG completo sobre un corpus sintético")
+    parser.add_argument("--chunk-sizes", default="500,1000", help="Tamaños de fragmento a comparar en --bench-rag")
+    parser.add_argument("--backends", default="local", help="Backends a comparar en --bench-rag (local,chroma)")
+    parser.add_argument("--servir", action="store_true",
+                        help="En lugar del chat, levanta un servidor HTTP (necesita aiohttp)")
+    parser.add_argument("--puerto", type=int, default=8000, help="Puerto del servidor HTTP")
+    args = parser.parse_args()
+    
+    if args.bench_ingesta:
+        benchmark_ingesta(num_archivos=args.archivos)
+        sys.exit()
+    
+    if args.bench_busqueda:
+        benchmark_busqueda()
+        sys.exit()
+    
+    if args.bench_rag:
+        benchmark_rag(num_archivos=args.archivos,
+                      chunk_sizes=[int(t) for t in args.chunk_sizes.split(",")],
+                      backends=args.backends.split(","))
+        sys.exit()
+    
+    main(backend=args.backend, servir_http=args.servir, puerto=args.puerto,
+         dtype=args.dtype, ivf=args.ivf, num_sondas=args.sondas)
\ No newline at end of file
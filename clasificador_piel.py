@@ -0,0 +1,131 @@
+import cv2
+import numpy as np
+
+# Rangos de color de piel que usa el lanzador de gestos
+SKIN_HSV = (np.array([0, 30, 60], dtype=np.uint8), np.array([20, 150, 255], dtype=np.uint8))
+SKIN_YCRCB = (np.array([0, 135, 85], dtype=np.uint8), np.array([255, 180, 135], dtype=np.uint8))
+
+
+class SkinClassifier:
+    """
+    Clasificador de piel con una tabla precalculada (LUT) de BGR -> piel/no piel.
+
+    El espacio BGR se divide en un cubo de bins x bins x bins (64 -> 262144 casillas)
+    y cada casilla se marca una sola vez como piel o no, ya sea con rangos HSV/YCrCb
+    (por mayoría de sus colores) o con muestras de calibración. Después, clasificar
+    un frame es una sola búsqueda vectorizada por píxel, sin convertir el frame a
+    otros espacios de color.
+
+    La cuantización solo falla en casillas partidas por el borde de un rango: con
+    64 bins difiere de los rangos exactos en ~0.3% de colores al azar, pero en un
+    frame hecho solo de colores de piel (casi todos cerca del borde) en ~4%, y
+    ~7% con un rango de tono angosto como el de manos.py. Con 128 bins baja a
+    ~1.6% / ~3% (la tabla ocupa 8 MB).
+
+    La tabla solo se recalcula cuando cambia la calibración (`version` aumenta).
+    """
+
+    def __init__(self, bins=64):
+        if 256 % bins:
+            raise ValueError("bins debe dividir a 256 (8, 16, 32, 64...)")
+        self.bins = bins
+        self.step = 256 // bins
+        self.version = 0
+        self.lut = np.zeros((bins, bins, bins), dtype=np.float32)
+        self._hist = None
+        # Tablas por canal para el camino sin calcBackProject (OpenCV sin cv2.Mat)
+        shift = int(np.log2(self.step))
+        levels = np.arange(256, dtype=np.int32) >> shift
+        self._channel_luts = (levels * bins * bins, levels * bins, levels)
+        self._set_lut(self.lut)
+
+    @classmethod
+    def from_thresholds(cls, hsv=None, ycrcb=None, bins=64):
+        classifier = cls(bins)
+        classifier.set_thresholds(hsv, ycrcb)
+        return classifier
+
+    @classmethod
+    def from_samples(cls, samples_bgr, bins=32, margin=1, min_count=1):
+        classifier = cls(bins)
+        classifier.calibrate_from_samples(samples_bgr, margin, min_count)
+        return classifier
+
+    @classmethod
+    def load(cls, path):
+        lut = np.load(path)
+        classifier = cls(lut.shape[0])
+        classifier._set_lut(lut)
+        return classifier
+
+    def save(self, path):
+        """Guarda la tabla para que otra herramienta use la misma calibración"""
+        np.save(path, self.lut)
+
+    def bin_colors(self, b_bin=None):
+        """
+        Todos los colores BGR como una imagen de 1 x N píxeles, ordenados por casilla
+        (cada casilla queda como step³ píxeles seguidos). Con `b_bin` solo los de
+        esa rebanada del canal azul, para no convertir 16M colores de golpe.
+        """
+        values = np.arange(256, dtype=np.uint8).reshape(self.bins, self.step)
+        blues = values if b_bin is None else values[b_bin:b_bin + 1]
+        b, g, r = np.meshgrid(blues, values, values, indexing='ij')
+        # Ejes (bin_b, bin_g, bin_r, sub_b, sub_g, sub_r): los colores de una casilla quedan juntos
+        colors = np.stack([b, g, r], axis=-1)
+        colors = colors.reshape(len(blues), self.step, self.bins, self.step, self.bins, self.step, 3)
+        return np.ascontiguousarray(colors.transpose(0, 2, 4, 1, 3, 5, 6)).reshape(1, -1, 3)
+
+    def set_thresholds(self, hsv=None, ycrcb=None, min_share=0.5):
+        """
+        Marca como piel las casillas donde al menos `min_share` de sus colores cae
+        en TODOS los rangos dados (votan los step³ colores, no solo el centro).
+        hsv / ycrcb son pares (inferior, superior); None = no se usa ese espacio.
+        """
+        lut = np.zeros((self.bins, self.bins, self.bins), dtype=np.uint8)
+        for b_bin in range(self.bins):
+            colors = self.bin_colors(b_bin)
+            mask = np.full(colors.shape[:2], 255, dtype=np.uint8)
+            for ranges, conversion in ((hsv, cv2.COLOR_BGR2HSV), (ycrcb, cv2.COLOR_BGR2YCR_CB)):
+                if ranges is not None:
+                    lower, upper = (np.asarray(limit, dtype=np.uint8) for limit in ranges)
+                    mask = cv2.bitwise_and(mask, cv2.inRange(cv2.cvtColor(colors, conversion), lower, upper))
+            share = (mask.reshape(self.bins, self.bins, -1) > 0).mean(axis=-1)
+            lut[b_bin] = (share >= min_share) * 255
+        self._set_lut(lut)
+
+    def calibrate_from_samples(self, samples_bgr, margin=1, min_count=1):
+        """
+        Marca como piel las casillas donde cayeron al menos `min_count` píxeles de
+        muestra, más `margin` casillas alrededor (para tolerar cambios de luz).
+        """
+        samples = np.ascontiguousarray(np.asarray(samples_bgr, dtype=np.uint8).reshape(1, -1, 3))
+        hist = cv2.calcHist([samples], [0, 1, 2], None, [self.bins] * 3, [0, 256] * 3)
+        skin = hist >= min_count
+
+        # "Engordamos" la región en el cubo: máximo sobre los vecinos, eje por eje
+        for axis in range(3):
+            grown = skin.copy()
+            for shift in range(1, margin + 1):
+                grown[(slice(None),) * axis + (slice(shift, None),)] |= skin[(slice(None),) * axis + (slice(None, -shift),)]
+                grown[(slice(None),) * axis + (slice(None, -shift),)] |= skin[(slice(None),) * axis + (slice(shift, None),)]
+            skin = grown
+        self._set_lut(skin.astype(np.uint8) * 255)
+
+    def _set_lut(self, lut):
+        self.lut = np.ascontiguousarray(lut, dtype=np.float32)
+        self._flat_lut = self.lut.astype(np.uint8).reshape(-1)
+        # calcBackProject necesita la tabla como Mat de 3 dimensiones (no como 32 canales)
+        self._hist = cv2.Mat(self.lut, wrap_channels=False) if hasattr(cv2, 'Mat') else None
+        self.version += 1
+
+    def mask(self, image_bgr):
+        """Máscara de piel (255 = piel) con una sola búsqueda en la tabla"""
+        if self._hist is not None:
+            return cv2.calcBackProject([image_bgr], [0, 1, 2], self._hist, [0, 256] * 3, 1)
+
+        # Sin cv2.Mat: índice de casilla por canal con cv2.LUT y búsqueda con NumPy
+        b, g, r = cv2.split(image_bgr)
+        lut_b, lut_g, lut_r = self._channel_luts
+        index = cv2.add(cv2.add(cv2.LUT(b, lut_b), cv2.LUT(g, lut_g)), cv2.LUT(r, lut_r))
+        return np.take(self._flat_lut, index)
@@ -1,11 +1,182 @@
 import cv2
 import subprocess
+import argparse
+import threading
 import time
 import os
+from collections import deque
 import numpy as np
+from clasificador_piel import SkinClassifier, SKIN_HSV, SKIN_YCRCB
 
-class GestureAppLauncher:
+
+# Orden de las características en el vector que devuelve extract_hand_features
+FEATURE_NAMES = ('fingers', 'circularity', 'solidity', 'area', 'perimeter', 'aspect_ratio',
+                 'defects', 'mean_angle', 'min_angle', 'mean_depth', 'max_depth')
+FEATURE_INDEX = {name: i for i, name in enumerate(FEATURE_NAMES)}
+
+
+def extract_hand_features(contour, hull_indices=None, defects=None, max_finger_angle=np.pi / 2):
+    """
+    Calcula las características de la mano como un vector float32 (ver FEATURE_NAMES).
+    Todos los defectos de convexidad se procesan de golpe con NumPy, sin ciclos.
+    
+    hull_indices y defects son opcionales: si ya se calcularon, se reutilizan.
+    """
+    features = np.zeros(len(FEATURE_NAMES), dtype=np.float32)
+    area = cv2.contourArea(contour)
+    perimeter = cv2.arcLength(contour, True)
+    _, _, w, h = cv2.boundingRect(contour)
+    features[FEATURE_INDEX['area']] = area
+    features[FEATURE_INDEX['perimeter']] = perimeter
+    features[FEATURE_INDEX['aspect_ratio']] = w / h if h else 0
+    if perimeter == 0:
+        return features
+    
+    # Circularidad (compacidad): 1 = círculo perfecto
+    features[FEATURE_INDEX['circularity']] = 4 * np.pi * area / (perimeter ** 2)
+    
+    # Solidez: qué tanto del hull llena la mano (puño ~1, mano abierta < 1)
+    if hull_indices is None:
+        hull_indices = cv2.convexHull(contour, returnPoints=False)
+    hull_area = cv2.contourArea(contour[hull_indices[:, 0]])
+    features[FEATURE_INDEX['solidity']] = area / hull_area if hull_area > 0 else 0
+    
+    if defects is None and len(hull_indices) > 3:
+        defects = cv2.convexityDefects(contour, hull_indices)
+    if defects is None or len(defects) == 0:
+        return features
+    
+    # Filas (inicio, fin, punto lejano, profundidad); según la versión de OpenCV
+    # llegan como (N, 1, 4) o (N, 4)
+    defects = defects.reshape(-1, 4)
+    points = contour.reshape(-1, 2).astype(np.float32)
+    start, end, far = points[defects[:, 0]], points[defects[:, 1]], points[defects[:, 2]]
+    depths = defects[:, 3] / 256.0  # OpenCV las da en punto fijo (8 bits de fracción)
+    
+    # Ley de cosenos para el ángulo en el punto lejano, para todos los defectos a la vez
+    a = np.linalg.norm(end - start, axis=1)
+    b = np.linalg.norm(far - start, axis=1)
+    c = np.linalg.norm(end - far, axis=1)
+    denominator = 2 * b * c
+    valid = denominator > 0  # Defectos degenerados (puntos repetidos) no cuentan
+    cos_angle = np.divide(b ** 2 + c ** 2 - a ** 2, denominator,
+                          out=np.ones_like(denominator), where=valid)
+    angles = np.arccos(np.clip(cos_angle, -1.0, 1.0))
+    
+    # Si el ángulo es menor que 90 grados, cuenta como un dedo
+    features[FEATURE_INDEX['fingers']] = np.count_nonzero(valid & (angles <= max_finger_angle))
+    features[FEATURE_INDEX['defects']] = len(defects)
+    if valid.any():
+        features[FEATURE_INDEX['mean_angle']] = angles[valid].mean()
+        features[FEATURE_INDEX['min_angle']] = angles[valid].min()
+    features[FEATURE_INDEX['mean_depth']] = depths.mean()
+    features[FEATURE_INDEX['max_depth']] = depths.max()
+    return features
+
+
+class HandAnalysis:
+    """Resultado de analizar UN frame: se calcula una vez y lo usan detección, dibujo y debug"""
+    
+    def __init__(self, mask, contour=None):
+        self.mask = mask
+        self.contour = contour
+        self.hull_indices = None  # Índices del hull (para convexityDefects)
+        self.hull_points = None   # Puntos del hull (para dibujar)
+        self.defects = None
+        self.features = np.zeros(len(FEATURE_NAMES), dtype=np.float32)
+        self.gesture = 'none'
+    
+    @property
+    def found(self):
+        return self.contour is not None
+    
+    def feature(self, name):
+        return float(self.features[FEATURE_INDEX[name]])
+    
+    @property
+    def area(self):
+        return self.feature('area')
+    
+    @property
+    def perimeter(self):
+        return self.feature('perimeter')
+    
+    @property
+    def circularity(self):
+        return self.feature('circularity')
+    
+    @property
+    def solidity(self):
+        return self.feature('solidity')
+    
+    @property
+    def finger_count(self):
+        return int(self.features[FEATURE_INDEX['fingers']])
+
+
+class LatestFrameBuffer:
+    """
+    Buffer de UN solo lugar entre dos hilos: quien escribe siempre pisa lo
+    anterior y quien lee se lleva lo más nuevo (el último frame gana). Así un
+    hilo lento nunca acumula frames viejos; simplemente se salta los que no alcanzó.
+    """
+    
     def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self._seq = 0
+        self.closed = False
+    
+    def put(self, item):
+        with self._cond:
+            self._item = item
+            self._seq += 1
+            self._cond.notify_all()
+    
+    def get(self, last_seq=0, timeout=0.5):
+        """Espera algo más nuevo que `last_seq`. Devuelve (seq, item) o (last_seq, None)"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > last_seq or self.closed, timeout)
+            if self._seq > last_seq:
+                return self._seq, self._item
+            return last_seq, None
+    
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class PipelineStats:
+    """Cuenta frames por etapa y guarda las latencias captura -> pantalla recientes"""
+    
+    def __init__(self, window=1000):
+        self.start = time.perf_counter()
+        self.counts = {'captura': 0, 'proceso': 0, 'render': 0}
+        self.skipped = {'proceso': 0, 'render': 0}
+        self.latencies = deque(maxlen=window)
+        self.render_times = deque(maxlen=30)
+    
+    def fps(self, stage):
+        return self.counts[stage] / max(time.perf_counter() - self.start, 1e-9)
+    
+    def live_fps(self):
+        if len(self.render_times) < 2:
+            return 0.0
+        return (len(self.render_times) - 1) / max(self.render_times[-1] - self.render_times[0], 1e-9)
+    
+    def summary(self):
+        lines = ["📊 Pipeline: " + "  ".join(f"{stage} {self.fps(stage):.1f} FPS" for stage in self.counts)]
+        lines.append(f"   Frames saltados: proceso {self.skipped['proceso']}, render {self.skipped['render']}")
+        if self.latencies:
+            ms = np.array(self.latencies) * 1000
+            lines.append(f"   Latencia captura->pantalla: p50 {np.percentile(ms, 50):.1f} ms  "
+                         f"p95 {np.percentile(ms, 95):.1f} ms  máx {ms.max():.1f} ms")
+        return "\n".join(lines)
+
+
+class GestureAppLauncher:
+    def __init__(self, camera_index=0, skin_classifier=None):
         # ============================================
         # CONFIGURA TUS LINKS AQUÍ
         # ============================================
@@ -16,51 +187,70 @@ class GestureAppLauncher:
         }
         # ============================================
         
-        self.cap = cv2.VideoCapture(0)
-        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+        # camera_index=None no abre la cámara (útil para el benchmark con video grabado)
+        self.cap = None
+        if camera_index is not None:
+            self.cap = cv2.VideoCapture(camera_index)
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
         
         self.current_gesture = 'none'
         self.gesture_start_time = 0
         self.gesture_hold_time = 2  # 2 segundos para activar
         self.launch_cooldown = 3  # 3 segundos entre lanzamientos
         self.last_launch_time = 0
-        
-    def detect_hand_contour(self, frame):
-        """Detecta la contorno de la mano usando color de piel y filtros mejorados"""
-        # Convertir a HSV y YCrCb para mejor detección de piel
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-        ycrcb = cv2.cvtColor(frame, cv2.COLOR_BGR2YCR_CB)
-        
-        # Rangos de color de piel en HSV
-        lower_skin_hsv = np.array([0, 30, 60], dtype=np.uint8)
-        upper_skin_hsv = np.array([20, 150, 255], dtype=np.uint8)
-        
-        # Rangos de color de piel en YCrCb
-        lower_skin_ycrcb = np.array([0, 135, 85], dtype=np.uint8)
-        upper_skin_ycrcb = np.array([255, 180, 135], dtype=np.uint8)
-        
-        # Crear máscaras
-        mask_hsv = cv2.inRange(hsv, lower_skin_hsv, upper_skin_hsv)
-        mask_ycrcb = cv2.inRange(ycrcb, lower_skin_ycrcb, upper_skin_ycrcb)
-        
-        # Combinar máscaras
-        mask = cv2.bitwise_and(mask_hsv, mask_ycrcb)
+        self.detect_every = 2  # Analizar 1 de cada N frames; los demás reutilizan el último análisis
+        self.last_analysis = None
+        self.stop_event = threading.Event()
+        self.pace_fps = None  # Si la fuente es un video, se lee a su velocidad real
+        
+        # Segmentación: seguimiento por región de interés y búsqueda a varias escalas
+        self.tracking = True
+        self.track_box = None      # (x, y, w, h) de la mano en el último frame
+        self.roi_padding = 0.5     # Cuánto se agranda la caja por lado (fracción de su tamaño)
+        self.roi_scale = 0.5       # La región se segmenta a media resolución
+        self.search_width = 320    # Ancho al que se reduce el frame cuando se busca la mano de cero
+        self.refine_padding = 0.1  # Margen (fracción del tamaño) al volver a segmentar la mano a escala 1
+        self.min_hand_area = 7000  # Área mínima de la mano (en píxeles de un frame de 640x480)
+        self._kernels = {}
+        
+        # Tabla de color de piel precalculada (se puede compartir con otras herramientas)
+        self.skin = skin_classifier or SkinClassifier.from_thresholds(hsv=SKIN_HSV, ycrcb=SKIN_YCRCB)
+        
+    def skin_mask(self, image):
+        """Máscara de piel (255 = piel): los rangos HSV y YCrCb ya vienen horneados en la tabla"""
+        return self.skin.mask(image)
+    
+    def morphology_kernel(self, scale):
+        """Elemento estructurante de 5x5 a resolución completa, escalado (se crea una vez por escala)"""
+        if scale not in self._kernels:
+            size = max(3, int(round(5 * scale)) | 1)
+            self._kernels[scale] = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size))
+        return self._kernels[scale]
+    
+    def segment_region(self, image, scale):
+        """Segmenta una región a `scale` de su resolución. Devuelve (contornos, máscara) a esa escala"""
+        if scale != 1.0:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        mask = self.skin_mask(image)
         
         # Aplicar operaciones morfológicas más agresivas
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+        kernel = self.morphology_kernel(scale)
         mask = cv2.erode(mask, kernel, iterations=1)
         mask = cv2.dilate(mask, kernel, iterations=2)
         mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
         
         # Encontrar contornos
         contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
+        return contours, mask
+    
+    def pick_hand_contour(self, contours, scale, offset, min_area):
+        """Elige el contorno que parece mano y lo regresa en coordenadas del frame completo"""
         # Filtrar contornos por área y forma
         valid_contours = []
         for contour in contours:
-            area = cv2.contourArea(contour)
-            if area < 7000:  # Ignora contornos muy pequeños
+            area = cv2.contourArea(contour) / (scale * scale)
+            if area < min_area:  # Ignora contornos muy pequeños
                 continue
                 
             # Calcular la proporción de aspecto del contorno
@@ -71,67 +261,112 @@ class GestureAppLauncher:
             if 0.5 <= aspect_ratio <= 1.5:
                 valid_contours.append(contour)
         
-        if valid_contours:
-            # Seleccionar el contorno más grande que cumple los criterios
-            hand_contour = max(valid_contours, key=cv2.contourArea)
-            return hand_contour, mask
+        if not valid_contours:
+            return None
         
-        return None, mask
+        # Seleccionar el contorno más grande que cumple los criterios
+        hand_contour = max(valid_contours, key=cv2.contourArea)
+        if scale == 1.0 and offset == (0, 0):
+            return hand_contour
+        return (hand_contour / scale + np.array(offset)).astype(np.int32)
     
-    def detect_gesture(self, frame):
-        """Detecta el gesto basado en el contorno de la mano"""
+    def tracking_roi(self, frame_shape):
+        """Región de interés: la última caja de la mano, agrandada `roi_padding` por lado"""
+        x, y, w, h = self.track_box
+        pad = int(self.roi_padding * max(w, h))
+        height, width = frame_shape[:2]
+        return max(0, x - pad), max(0, y - pad), min(width, x + w + pad), min(height, y + h + pad)
+    
+    def refine_hand_contour(self, frame, hand_contour, min_area):
+        """
+        Vuelve a segmentar a resolución completa solo la caja de la mano.
+        
+        Un contorno sacado a media resolución y reescalado tiene bordes más suaves
+        (la circularidad sube ~0.05-0.1 y cruza el umbral de 'piedra'), así que
+        las características siempre se calculan sobre la segmentación a escala 1.
+        """
+        x, y, w, h = cv2.boundingRect(hand_contour)
+        pad = int(self.refine_padding * max(w, h)) + 8  # Margen para el error del contorno reducido
+        height, width = frame.shape[:2]
+        x0, y0 = max(0, x - pad), max(0, y - pad)
+        x1, y1 = min(width, x + w + pad), min(height, y + h + pad)
+        contours, _ = self.segment_region(frame[y0:y1, x0:x1], 1.0)
+        refined = self.pick_hand_contour(contours, 1.0, (x0, y0), min_area)
+        return refined if refined is not None else hand_contour
+    
+    def detect_hand_contour(self, frame):
+        """
+        Detecta la contorno de la mano usando color de piel y filtros mejorados.
+        
+        Con seguimiento activo, si en el frame anterior hubo mano solo se segmenta
+        una región alrededor de ella (a media resolución); si se pierde, se busca
+        en todo el frame reducido a `search_width` de ancho. Así el costo depende
+        del tamaño de la mano y no de la resolución de la cámara. Una vez ubicada,
+        la caja de la mano se segmenta a resolución completa para que el contorno
+        (y el gesto) sea el mismo que sin seguimiento.
+        
+        La máscara devuelta es la de la región buscada, a la escala en que se procesó.
+        """
+        height, width = frame.shape[:2]
+        # min_hand_area está pensado para 640x480; se ajusta a la resolución real
+        min_area = self.min_hand_area * (height * width) / (640 * 480)
+        
+        hand_contour = None
+        if self.tracking and self.track_box is not None:
+            x0, y0, x1, y1 = self.tracking_roi(frame.shape)
+            contours, mask = self.segment_region(frame[y0:y1, x0:x1], self.roi_scale)
+            hand_contour = self.pick_hand_contour(contours, self.roi_scale, (x0, y0), min_area)
+            scale = self.roi_scale
+        
+        if hand_contour is None:  # Sin seguimiento o se perdió la mano: se busca en todo el frame
+            scale = min(1.0, self.search_width / width) if self.tracking else 1.0
+            contours, mask = self.segment_region(frame, scale)
+            hand_contour = self.pick_hand_contour(contours, scale, (0, 0), min_area)
+        
+        if hand_contour is not None and scale != 1.0:
+            hand_contour = self.refine_hand_contour(frame, hand_contour, min_area)
+        self.track_box = cv2.boundingRect(hand_contour) if hand_contour is not None else None
+        return hand_contour, mask
+    
+    def analyze_frame(self, frame):
+        """Segmenta la mano y calcula todas sus características UNA sola vez por frame"""
         hand_contour, mask = self.detect_hand_contour(frame)
-        
+        analysis = HandAnalysis(mask, hand_contour)
         if hand_contour is None:
+            return analysis
+        
+        # Hull y defectos se guardan para dibujar; las características salen de una sola pasada
+        analysis.hull_indices = cv2.convexHull(hand_contour, returnPoints=False)
+        analysis.hull_points = hand_contour[analysis.hull_indices[:, 0]]
+        if len(analysis.hull_indices) > 3:
+            defects = cv2.convexityDefects(hand_contour, analysis.hull_indices)
+            analysis.defects = defects.reshape(-1, 4) if defects is not None else None
+        analysis.features = extract_hand_features(hand_contour, analysis.hull_indices, analysis.defects)
+        
+        analysis.gesture = self.classify_gesture(analysis)
+        return analysis
+    
+    def classify_gesture(self, analysis):
+        """Clasifica el gesto con las características ya calculadas (no toca el frame)"""
+        if not analysis.found or analysis.perimeter == 0:
             return 'none'
         
-        # Calcular área y perímetro
-        area = cv2.contourArea(hand_contour)
-        perimeter = cv2.arcLength(hand_contour, True)
-        
-        # Calcular circularidad (compacidad)
-        if perimeter == 0:
-            return 'none'
-        circularity = 4 * np.pi * area / (perimeter ** 2)
-        
-        # Calcular hull y defectos
-        hull = cv2.convexHull(hand_contour, returnPoints=False)
-        defects = cv2.convexityDefects(hand_contour, hull)
-        
-        # Contar dedos usando defectos de convexidad
-        finger_count = 0
-        if defects is not None:
-            for i in range(defects.shape[0]):
-                s, e, f, d = defects[i, 0]
-                start = tuple(hand_contour[s][0])
-                end = tuple(hand_contour[e][0])
-                far = tuple(hand_contour[f][0])
-                
-                # Calcular el ángulo entre los puntos
-                a = np.sqrt((end[0] - start[0])**2 + (end[1] - start[1])**2)
-                b = np.sqrt((far[0] - start[0])**2 + (far[1] - start[1])**2)
-                c = np.sqrt((end[0] - far[0])**2 + (end[1] - far[1])**2)
-                angle = np.arccos((b**2 + c**2 - a**2)/(2*b*c))
-                
-                # Si el ángulo es menor que 90 grados, cuenta como un dedo
-                if angle <= np.pi/2:
-                    finger_count += 1
-        
-        # Dibujar contorno y hull para debug visual
-        cv2.drawContours(frame, [hand_contour], -1, (0, 255, 0), 2)
-        hull_points = cv2.convexHull(hand_contour)
-        cv2.drawContours(frame, [hull_points], -1, (0, 0, 255), 2)
-        
         # Clasificar gestos basado en circularidad y dedos
-        if circularity > 0.85:  # Forma más circular = puño cerrado (piedra)
+        if analysis.circularity > 0.85:  # Forma más circular = puño cerrado (piedra)
             return 'rock'
-        elif finger_count >= 4:  # 4 o más dedos = mano abierta (papel)
+        elif analysis.finger_count >= 4:  # 4 o más dedos = mano abierta (papel)
             return 'paper'
-        elif 1 <= finger_count <= 3:  # 1-3 dedos = tijeras
+        elif 1 <= analysis.finger_count <= 3:  # 1-3 dedos = tijeras
             return 'scissors'
         
         return 'none'
     
+    def detect_gesture(self, frame):
+        """Detecta el gesto basado en el contorno de la mano"""
+        analysis = self.analyze_frame(frame)
+        self.draw_analysis(frame, analysis)
+        return analysis.gesture
+    
     def launch_application(self, gesture):
         """Abre la aplicación asociada al gesto"""
         if gesture not in self.gesture_paths or gesture == 'none':
@@ -167,18 +402,29 @@ class GestureAppLauncher:
             print(f"   Tipo de archivo: {os.path.splitext(path)[1]}")
             return False
     
-    def draw_hand_contour(self, frame):
+    def draw_analysis(self, frame, analysis):
+        """Dibuja contorno y hull para debug visual (sin volver a segmentar)"""
+        if not analysis.found:
+            return frame
+        
+        cv2.drawContours(frame, [analysis.contour], -1, (0, 255, 0), 2)
+        if analysis.hull_points is not None:
+            cv2.drawContours(frame, [analysis.hull_points], -1, (0, 0, 255), 2)
+        return frame
+    
+    def draw_hand_contour(self, frame, analysis=None):
         """Dibuja el contorno de la mano en rojo"""
-        hand_contour, mask = self.detect_hand_contour(frame)
+        if analysis is None:
+            analysis = self.analyze_frame(frame)
         
-        if hand_contour is not None:
+        if analysis.found:
             # Dibujar el contorno en rojo grueso
-            cv2.drawContours(frame, [hand_contour], 0, (0, 0, 255), 3)
+            cv2.drawContours(frame, [analysis.contour], 0, (0, 0, 255), 3)
             
             # Dibujar círculos rojos en los puntos del contorno
-            for point in hand_contour:
+            for point in analysis.contour:
                 x, y = point[0]
-                cv2.circle(frame, (x, y), 2, (0, 0, 255), -1)
+                cv2.circle(frame, (int(x), int(y)), 2, (0, 0, 255), -1)
         
         return frame
     
@@ -240,8 +486,7 @@ class GestureAppLauncher:
         
         return frame
     
-    def run(self):
-        """Ejecuta el programa principal"""
+    def print_banner(self):
         print("=" * 60)
         print("🎮 DETECTOR DE GESTOS - ABRE APLICACIONES")
         print("=" * 60)
@@ -255,7 +500,42 @@ class GestureAppLauncher:
         print("  • Mantén el gesto durante 2 segundos")
         print("  • La aplicación se abrirá automáticamente")
         print("\n⚠️  Presiona ESC para salir\n")
-        
+    
+    def update_gesture_state(self, new_gesture):
+        """Lleva la cuenta de cuánto tiempo se mantiene el gesto y lanza la app al cumplirse"""
+        if new_gesture != 'none':
+            if new_gesture != self.current_gesture:
+                self.current_gesture = new_gesture
+                self.gesture_start_time = time.time()
+            
+            # Verificar si se ha mantenido el gesto suficiente tiempo
+            elapsed = time.time() - self.gesture_start_time
+            if elapsed >= self.gesture_hold_time:
+                self.launch_application(new_gesture)
+                self.current_gesture = 'none'
+        else:
+            self.current_gesture = 'none'
+    
+    def render(self, frame, analysis):
+        """Dibuja el análisis y la información sobre el frame"""
+        # Dibujar contorno de la mano (y hull) con el análisis ya calculado
+        self.draw_analysis(frame, analysis)
+        frame = self.draw_hand_contour(frame, analysis)
+        
+        # Dibujar información
+        is_holding = time.time() - self.gesture_start_time < self.gesture_hold_time
+        return self.draw_info(frame, self.current_gesture, is_holding)
+    
+    def run(self, threaded=True, show=True):
+        """Ejecuta el programa principal"""
+        self.print_banner()
+        if threaded:
+            self.run_pipeline(show)
+        else:
+            self.run_serial()
+    
+    def run_serial(self):
+        """Todo en un solo hilo: leer, analizar, dibujar y mostrar, uno tras otro"""
         frame_count = 0
         
         while True:
@@ -266,32 +546,14 @@ class GestureAppLauncher:
             # Espejo horizontal
             frame = cv2.flip(frame, 1)
             
-            # Detectar gesto cada 2 frames para mejor rendimiento
-            if frame_count % 2 == 0:
-                new_gesture = self.detect_gesture(frame)
-                
-                if new_gesture != 'none':
-                    if new_gesture != self.current_gesture:
-                        self.current_gesture = new_gesture
-                        self.gesture_start_time = time.time()
-                    
-                    # Verificar si se ha mantenido el gesto suficiente tiempo
-                    elapsed = time.time() - self.gesture_start_time
-                    if elapsed >= self.gesture_hold_time:
-                        self.launch_application(new_gesture)
-                        self.current_gesture = 'none'
-                else:
-                    self.current_gesture = 'none'
+            # Analizar la mano cada N frames; en los demás se reutiliza el último análisis
+            if frame_count % self.detect_every == 0 or self.last_analysis is None:
+                self.last_analysis = self.analyze_frame(frame)
+                self.update_gesture_state(self.last_analysis.gesture)
             
             frame_count += 1
             
-            # Dibujar contorno de la mano en rojo
-            frame = self.draw_hand_contour(frame)
-            
-            # Dibujar información
-            is_holding = time.time() - self.gesture_start_time < self.gesture_hold_time
-            frame = self.draw_info(frame, self.current_gesture, is_holding)
-            
+            frame = self.render(frame, self.last_analysis)
             cv2.imshow('Detector de Gestos', frame)
             
             # Salir con ESC
@@ -301,7 +563,190 @@ class GestureAppLauncher:
         
         self.cap.release()
         cv2.destroyAllWindows()
+    
+    # ------------------------------------------------------------------
+    # Pipeline en hilos: captura -> proceso -> render
+    # OpenCV suelta el GIL en sus funciones, así que las etapas corren en paralelo
+    # ------------------------------------------------------------------
+    
+    def capture_loop(self, captured, stats):
+        """Hilo de captura: siempre deja en el buffer el frame más reciente de la cámara"""
+        next_time = time.perf_counter()
+        try:
+            while not self.stop_event.is_set():
+                ret, frame = self.cap.read()
+                if not ret:
+                    break
+                captured_at = time.perf_counter()
+                stats.counts['captura'] += 1
+                captured.put((captured_at, cv2.flip(frame, 1)))
+                
+                if self.pace_fps:
+                    next_time += 1 / self.pace_fps
+                    time.sleep(max(0, next_time - time.perf_counter()))
+        except Exception as e:
+            print(f"❌ Error en el hilo de captura: {e}")
+        finally:
+            # Pase lo que pase, las demás etapas se enteran de que ya no habrá más frames
+            self.stop_event.set()
+            captured.close()
+    
+    def process_loop(self, captured, processed, stats):
+        """Hilo de proceso: analiza el frame más nuevo y actualiza el estado del gesto"""
+        seq = 0
+        try:
+            while not self.stop_event.is_set() or not captured.closed:
+                new_seq, item = captured.get(seq)
+                if item is None:
+                    if captured.closed:
+                        break
+                    continue
+                stats.skipped['proceso'] += new_seq - seq - 1
+                seq = new_seq
+                
+                captured_at, frame = item
+                analysis = self.analyze_frame(frame)
+                self.last_analysis = analysis
+                self.update_gesture_state(analysis.gesture)
+                stats.counts['proceso'] += 1
+                processed.put((captured_at, frame, analysis))
+        except Exception as e:
+            print(f"❌ Error en el hilo de proceso: {e}")
+        finally:
+            # Si este hilo muere, el render no debe quedarse esperando para siempre
+            self.stop_event.set()
+            processed.close()
+    
+    def run_pipeline(self, show=True):
+        """Captura, proceso y render en etapas paralelas con buffers de un solo lugar"""
+        captured, processed = LatestFrameBuffer(), LatestFrameBuffer()
+        stats = PipelineStats()
+        self.stop_event.clear()
+        workers = [
+            threading.Thread(target=self.capture_loop, args=(captured, stats), daemon=True),
+            threading.Thread(target=self.process_loop, args=(captured, processed, stats), daemon=True),
+        ]
+        for worker in workers:
+            worker.start()
+        
+        # El render se queda en el hilo principal (imshow/waitKey lo necesitan en varios sistemas)
+        seq = 0
+        try:
+            while True:
+                new_seq, item = processed.get(seq, timeout=0.03)
+                if item is None:
+                    if processed.closed:
+                        break
+                else:
+                    stats.skipped['render'] += new_seq - seq - 1
+                    seq = new_seq
+                    captured_at, frame, analysis = item
+                    frame = self.render(frame, analysis)
+                    stats.render_times.append(time.perf_counter())
+                    cv2.putText(frame, f"{stats.live_fps():.0f} FPS  {stats.latencies[-1] * 1000:.0f} ms"
+                                if stats.latencies else "", (frame.shape[1] - 200, frame.shape[0] - 20),
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (200, 200, 200), 1)
+                    if show:
+                        cv2.imshow('Detector de Gestos', frame)
+                    stats.latencies.append(time.perf_counter() - captured_at)
+                    stats.counts['render'] += 1
+                
+                # Salir con ESC
+                if show and cv2.waitKey(1) & 0xFF == 27:
+                    print("\n👋 ¡Hasta luego!")
+                    break
+        finally:
+            self.stop_event.set()
+            captured.close()
+            for worker in workers:
+                worker.join(timeout=2)
+            self.cap.release()
+            if show:
+                cv2.destroyAllWindows()
+            print(stats.summary())
+
+def benchmark_video(video_path, max_frames=300, scale=1.0):
+    """
+    Mide el tiempo por frame sobre un video grabado: la forma anterior (segmentar
+    todo el frame a resolución completa en detect_gesture y otra vez en
+    draw_hand_contour) contra la actual (un análisis compartido cada
+    `detect_every` frames, con seguimiento por región de interés).
+    
+    `scale` agranda los frames (p. ej. 3 para simular 1080p con un video de 640x480).
+    """
+    launcher = GestureAppLauncher(camera_index=None)
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    while len(frames) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if scale != 1.0:
+            frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+        frames.append(cv2.flip(frame, 1))
+    cap.release()
+    if not frames:
+        print(f"❌ No se pudo leer el video: {video_path}")
+        return
+    
+    def anterior(i, frame):
+        if i % 2 == 0:
+            launcher.detect_gesture(frame)  # Segmenta, clasifica y dibuja
+        # draw_hand_contour segmentaba otra vez el mismo frame
+        contour, mask = launcher.detect_hand_contour(frame)
+        launcher.draw_hand_contour(frame, HandAnalysis(mask, contour))
+    
+    def actual(i, frame):
+        if i % launcher.detect_every == 0 or launcher.last_analysis is None:
+            launcher.last_analysis = launcher.analyze_frame(frame)
+        launcher.draw_analysis(frame, launcher.last_analysis)
+        launcher.draw_hand_contour(frame, launcher.last_analysis)
+    
+    print(f"📊 {len(frames)} frames de {frames[0].shape[1]}x{frames[0].shape[0]}")
+    for name, step in (("anterior", anterior), ("actual", actual)):
+        launcher.tracking = name == "actual"
+        launcher.track_box = None
+        launcher.last_analysis = None
+        found = 0
+        times = []
+        for i, frame in enumerate(frames):
+            frame = frame.copy()
+            start = time.perf_counter()
+            step(i, frame)
+            times.append(time.perf_counter() - start)
+            found += launcher.track_box is not None
+        times_ms = np.array(times) * 1000
+        print(f"   {name:>8}: {times_ms.mean():6.2f} ms/frame  p50 {np.percentile(times_ms, 50):6.2f}  "
+              f"p95 {np.percentile(times_ms, 95):6.2f}  (~{1000 / times_ms.mean():.0f} FPS de CPU)  "
+              f"mano en {found}/{len(frames)} frames")
+    
+    # El seguimiento solo debe cambiar el costo, no el gesto: se comparan frame a frame
+    gestures = {}
+    for tracking in (False, True):
+        launcher.tracking = tracking
+        launcher.track_box = None
+        gestures[tracking] = [launcher.analyze_frame(frame.copy()).gesture for frame in frames]
+    same = sum(a == b for a, b in zip(gestures[False], gestures[True]))
+    print(f"   gesto igual con y sin seguimiento en {same}/{len(frames)} frames")
+
 
 if __name__ == '__main__':
-    launcher = GestureAppLauncher()
-    launcher.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Detector de gestos que abre aplicaciones")
+    parser.add_argument("--bench", metavar="VIDEO", help="Mide el tiempo por frame sobre un video grabado")
+    parser.add_argument("--frames", type=int, default=300, help="Máximo de frames a usar en --bench")
+    parser.add_argument("--bench-scale", type=float, default=1.0,
+                        help="Agranda los frames en --bench (3 = simula 1080p con video de 640x480)")
+    parser.add_argument("--source", default="0", help="Número de cámara o ruta de un video grabado")
+    parser.add_argument("--serial", action="store_true", help="Todo en un solo hilo (sin pipeline)")
+    parser.add_argument("--no-window", action="store_true", help="No mostrar la ventana (para medir)")
+    args = parser.parse_args()
+    
+    if args.bench:
+        benchmark_video(args.bench, args.frames, args.bench_scale)
+    else:
+        # La fuente puede ser el número de cámara o un video grabado
+        source = int(args.source) if args.source.isdigit() else args.source
+        launcher = GestureAppLauncher(camera_index=source)
+        if not isinstance(source, int):
+            launcher.pace_fps = launcher.cap.get(cv2.CAP_PROP_FPS) or 30
+        launcher.run(threaded=not args.serial, show=not args.no_window)
\ No newline at end of file
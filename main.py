@@ -1,9 +1,32 @@
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import re
 import math
-from datetime import datetime
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 import sys
+import os
+import argparse
+import asyncio
+import ast
+import operator
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict, namedtuple, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from functools import lru_cache
+
+try:
+    import aiohttp  # Opcional: solo lo usa el motor asíncrono
+    from aiohttp import web
+except ImportError:
+    aiohttp = None
+    web = None
 
 # --- Constantes de Estilo y Color ---
 class Style:
@@ -20,16 +43,605 @@ class Color:
     FAIL = '\033[91m'   # Rojo
     ENDC = '\033[0m'    # Final de Color
 
+# --- Evaluador matemático seguro (AST validado y compilado una sola vez) ---
+MAX_EXPONENT = 10000     # Evita que algo como 9**9**9 congele el bot
+MAX_RESULT_BITS = 1_000_000  # Tamaño máximo de un entero intermedio: (9**10000)**1000 no se calcula
+MAX_COMB_BITS = 100_000     # math.comb se vuelve mucho más lento que perm conforme crece el resultado
+MAX_FACTORIAL = 1000
+
+def _check_bits(bits, limit=MAX_RESULT_BITS):
+    if bits > limit:
+        raise ValueError(f"resultado demasiado grande (~{bits:.3g} bits)")
+
+def _safe_pow(base, exponent):
+    if isinstance(exponent, (int, float)) and abs(exponent) > MAX_EXPONENT:
+        raise ValueError(f"exponente demasiado grande ({exponent})")
+    # El tamaño del resultado se estima antes de calcularlo
+    if isinstance(base, int) and isinstance(exponent, int) and abs(base) > 1:
+        _check_bits(abs(base).bit_length() * abs(exponent))
+    return operator.pow(base, exponent)
+
+def _safe_mul(left, right):
+    if isinstance(left, int) and isinstance(right, int):
+        _check_bits(abs(left).bit_length() + abs(right).bit_length())
+    return operator.mul(left, right)
+
+def _safe_factorial(n):
+    if n > MAX_FACTORIAL:
+        raise ValueError(f"factorial demasiado grande ({n})")
+    return math.factorial(n)
+
+def _log2_factorial_ratio(n, k):
+    """log2(n! / k!) estimado con lgamma, sin calcular los factoriales"""
+    return (math.lgamma(n + 1) - math.lgamma(k + 1)) / math.log(2)
+
+def _safe_perm(n, k=None):
+    # Solo se estima con argumentos válidos; los inválidos los rechaza math.perm
+    if isinstance(n, int) and n >= 0 and (k is None or isinstance(k, int) and 0 <= k <= n):
+        _check_bits(_log2_factorial_ratio(n, n - (n if k is None else k)))
+    return math.perm(n, k)
+
+def _safe_comb(n, k):
+    if isinstance(n, int) and isinstance(k, int) and 0 <= k <= n:
+        _check_bits(_log2_factorial_ratio(n, n - k) - _log2_factorial_ratio(k, 0), MAX_COMB_BITS)
+    return math.comb(n, k)
+
+def _safe_lcm(*integers):
+    # El mcm nunca tiene más bits que el producto de sus argumentos
+    _check_bits(sum(abs(i).bit_length() for i in integers if isinstance(i, int)))
+    return math.lcm(*integers)
+
+# Nombres permitidos: funciones y constantes de math (construido una sola vez, no en cada llamada)
+SAFE_MATH_NAMES = {
+    k: v for k, v in math.__dict__.items()
+    if not k.startswith("_")
+}
+# Las funciones enteras que pueden crecer sin límite van con su versión acotada
+# (gcd e isqrt nunca dan más bits que sus argumentos; las demás trabajan con float)
+SAFE_MATH_NAMES.update({
+    "abs": abs, "round": round, "factorial": _safe_factorial,
+    "perm": _safe_perm, "comb": _safe_comb, "lcm": _safe_lcm,
+})
+
+# Nodos del AST que puede tener una expresión válida
+SAFE_AST_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Name, ast.Load, ast.Call,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.USub, ast.UAdd,
+)
+
+
+class _GuardOperators(ast.NodeTransformer):
+    """Reescribe a ** b y a * b como _pow(a, b) y _mul(a, b) para poder limitar el tamaño del resultado"""
+    GUARDED = {ast.Pow: "_pow", ast.Mult: "_mul"}
+    
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        name = self.GUARDED.get(type(node.op))
+        if name is not None:
+            return ast.copy_location(
+                ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=[node.left, node.right], keywords=[]),
+                node
+            )
+        return node
+
+
+def normalize_expression(expression):
+    """Forma canónica de la expresión para usarla como clave de caché.
+    
+    Solo colapsa los espacios: quitarlos todos cambiaría el significado
+    ("2 3" se volvería 23 y "5 e 3" se volvería 5e3).
+    """
+    return " ".join(expression.split())
+
+
+@lru_cache(maxsize=1024)
+def compile_expression(normalized_expr):
+    """Parsea, valida contra la lista blanca y compila la expresión a una función sin argumentos"""
+    try:
+        tree = ast.parse(normalized_expr, mode="eval")
+    except SyntaxError:
+        raise ValueError(f"expresión inválida: {normalized_expr!r}")
+    
+    for node in ast.walk(tree):
+        if not isinstance(node, SAFE_AST_NODES):
+            raise ValueError(f"operación no permitida: {type(node).__name__}")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise ValueError(f"constante no permitida: {node.value!r}")
+        if isinstance(node, ast.Name) and node.id not in SAFE_MATH_NAMES:
+            raise ValueError(f"nombre no permitido: {node.id}")
+        if isinstance(node, ast.Call) and (not isinstance(node.func, ast.Name) or node.keywords):
+            raise ValueError("solo se permiten llamadas simples a funciones de math")
+    
+    tree = ast.fix_missing_locations(_GuardOperators().visit(tree))
+    code = compile(tree, "<expresion>", "eval")
+    namespace = {"__builtins__": {}, "_pow": _safe_pow, "_mul": _safe_mul, **SAFE_MATH_NAMES}
+    return lambda: eval(code, namespace)
+
+
+def evaluate_expression(expression):
+    """Evalúa una expresión matemática; las repetidas reusan la versión ya compilada"""
+    return compile_expression(normalize_expression(expression))()
+
+
+def evaluate_many(expressions):
+    """Evalúa muchas expresiones; los errores se devuelven en su posición en lugar de lanzarse"""
+    results = []
+    for expression in expressions:
+        try:
+            results.append(evaluate_expression(expression))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def extract_math_expression(text):
+    """Quita del texto las palabras que no son funciones/constantes de math y los símbolos extraños"""
+    text = re.sub(r'[^\W\d]\w*', lambda m: m.group() if m.group() in SAFE_MATH_NAMES else '', text)
+    return re.sub(r'[^\w+\-*/%().,\s]', '', text)
+
+
+def has_math_expression(text):
+    """True si el texto trae una expresión con números que el evaluador acepta"""
+    expression = extract_math_expression(text)
+    if not re.search(r'\d', expression):
+        return False
+    try:
+        compile_expression(normalize_expression(expression))
+        return True
+    except ValueError:
+        return False
+
+
+def benchmark_math(iterations=20000):
+    """Microbenchmark: evaluador compilado vs. el camino anterior (regex + dict + eval)"""
+    expressions = ["2 + 2", "(3.5 * 4) / 2 - 1", "2 ** 10 + 7 - 3", "((1 + 2) * (3 + 4)) / 5"]
+    
+    def legacy(expression):
+        clean_expr = re.sub(r'[^0-9+\-*/().\s]', '', expression)
+        allowed_names = {k: v for k, v in math.__dict__.items() if not k.startswith("__")}
+        allowed_names.update({"abs": abs, "round": round})
+        return eval(clean_expr, {"__builtins__": {}}, allowed_names)
+    
+    def compiled(expression):
+        return evaluate_expression(extract_math_expression(expression))
+    
+    print(f"{Color.OKCYAN}{Style.BOLD}Benchmark de evaluación matemática{Style.RESET} ({iterations} iteraciones)")
+    for name, fn in [("anterior (eval)", legacy), ("compilado (AST)", compiled)]:
+        start = time.perf_counter()
+        for i in range(iterations):
+            fn(expressions[i % len(expressions)])
+        elapsed = time.perf_counter() - start
+        print(f"  {name:<17} {elapsed * 1e6 / iterations:8.2f} µs/expresión")
+    
+    start = time.perf_counter()
+    evaluate_many(expressions * (iterations // len(expressions)))
+    elapsed = time.perf_counter() - start
+    print(f"  {'lote (batch)':<17} {elapsed * 1e6 / iterations:8.2f} µs/expresión")
+
+# Marca de fin de stream ("data: [DONE]") en las respuestas SSE
+SSE_DONE = object()
+
+# --- Historial con presupuesto de tokens ---
+class HistoryManager:
+    """Mantiene el historial dentro de un presupuesto de tokens.
+    
+    Descarta (o resume) los turnos más viejos para que el costo por turno
+    sea plano en lugar de crecer con la duración de la sesión.
+    """
+    # Tokens extra que cuesta cada mensaje (rol, separadores)
+    MESSAGE_OVERHEAD = 4
+    
+    def __init__(self, budget=6000, summarizer=None, keep_last=2):
+        self.budget = budget            # 8192 de contexto menos los 1000 de respuesta y margen
+        self.summarizer = summarizer    # callable(resumen_previo, mensajes_descartados) -> str
+        self.keep_last = keep_last      # Mensajes recientes que nunca se descartan
+        self.summary = ""
+        self.summary_message = None
+    
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def estimate_tokens(text):
+        """Estimación rápida (~4 caracteres por token), cacheada por contenido"""
+        return len(text) // 4 + 1
+    
+    def message_tokens(self, message):
+        return self.estimate_tokens(message["content"]) + self.MESSAGE_OVERHEAD
+    
+    def total_tokens(self, history):
+        return sum(self.message_tokens(m) for m in history)
+    
+    def compact(self, history):
+        """Recorta en su lugar el historial hasta que quepa en el presupuesto"""
+        total = self.total_tokens(history)
+        if total <= self.budget:
+            return history
+        
+        # El resumen previo (si existe) se regenera junto con lo que se descarte;
+        # su tamaño sigue contando en total como estimación del resumen nuevo
+        start = 1 if history and history[0] is self.summary_message else 0
+        
+        dropped = []
+        end = start
+        while total > self.budget and end < len(history) - self.keep_last:
+            total -= self.message_tokens(history[end])
+            dropped.append(history[end])
+            end += 1
+        
+        # No cortar entre la pregunta y su respuesta: el historial empieza con un mensaje del usuario.
+        # Una respuesta que quedó huérfana se descarta (o pasa al resumen) aunque keep_last la protegiera
+        next_user = next((i for i in range(end, len(history)) if history[i]["role"] == "user"), None)
+        if next_user is not None:
+            dropped.extend(history[end:next_user])
+            end = next_user
+        
+        del history[:end]
+        
+        if self.summarizer is not None and dropped:
+            try:
+                self.summary = self.summarizer(self.summary, dropped)
+            except Exception:
+                pass  # Si el resumen falla, simplemente se descartan los turnos
+        
+        if self.summary:
+            self.summary_message = {
+                "role": "system",
+                "content": f"Resumen de la conversación previa: {self.summary}"
+            }
+            history.insert(0, self.summary_message)
+        
+        return history
+
+# --- Detección de intención en una sola pasada ---
+# spans: [(inicio, fin, palabra), ...]; matched: todas las intenciones encontradas, de mayor a menor prioridad
+IntentMatch = namedtuple("IntentMatch", ["intent", "spans", "matched"])
+
+
+class IntentMatcher:
+    """Compila las palabras clave de todas las intenciones en una sola expresión regular.
+    
+    Una sola pasada sobre el mensaje devuelve la intención ganadora (la de mayor
+    prioridad) y las posiciones de las palabras encontradas, sin importar cuántas
+    intenciones o palabras clave se registren.
+    """
+    def __init__(self, default='conversation'):
+        self.default = default
+        self.intents = {}       # nombre -> (prioridad, palabras, patrones)
+        self._regex = None
+        self._groups = {}       # grupo del regex -> nombre de la intención
+        self._keywords = {}     # palabra clave (minúsculas) -> intenciones que la usan
+    
+    def register(self, name, keywords=(), priority=0, patterns=()):
+        """Registra (o reemplaza) una intención; gana la de mayor prioridad
+        y, a igual prioridad, la que se registró primero"""
+        self.intents[name] = (priority, list(keywords), list(patterns))
+        self._regex = None  # Se recompila en el siguiente match
+        return self
+    
+    def _compile(self):
+        alternatives = []
+        self._groups = {}
+        self._keywords = {}
+        for i, (name, (priority, keywords, patterns)) in enumerate(self.intents.items()):
+            for keyword in keywords:
+                self._keywords.setdefault(keyword.lower(), []).append(name)
+            if patterns:
+                group = f"i{i}"
+                self._groups[group] = name
+                alternatives.append(f"(?P<{group}>{'|'.join(f'(?:{pattern})' for pattern in patterns)})")
+        
+        # Las palabras de TODAS las intenciones van juntas y las más largas primero, así
+        # "webhook" gana a "web" (y "buscar" a "busca") sin importar quién se registró antes
+        if self._keywords:
+            keywords = sorted(self._keywords, key=len, reverse=True)
+            alternatives.insert(0, f"(?P<kw>{'|'.join(re.escape(k) for k in keywords)})")
+        self._regex = re.compile("|".join(alternatives) or r"(?!)", re.IGNORECASE)
+    
+    def match(self, message):
+        if self._regex is None:
+            self._compile()
+        
+        spans, matched = [], set()
+        for m in self._regex.finditer(message):
+            if m.lastgroup == "kw":
+                matched.update(self._keywords.get(m.group().lower(), ()))
+            else:
+                matched.add(self._groups[m.lastgroup])
+            spans.append((m.start(), m.end(), m.group().lower()))
+        
+        # Orden de registro primero (sort es estable): los empates de prioridad no dependen del hash
+        matched = [name for name in self.intents if name in matched]
+        matched.sort(key=lambda name: self.intents[name][0], reverse=True)
+        return IntentMatch(matched[0] if matched else self.default, spans, matched)
+
+
+def build_default_intents():
+    """Intenciones con las que arranca el bot (búsqueda web gana a matemáticas)"""
+    matcher = IntentMatcher()
+    matcher.register('web_search', ['buscar', 'busca', 'search', 'google', 'web', 'internet', 'información sobre'], priority=20)
+    # Matemáticas: palabras clave o un mensaje hecho solo de números y operadores
+    matcher.register('math', ['calcular', 'resolver', 'matemática', 'suma', 'resta', 'multiplicar', 'dividir'],
+                     priority=10, patterns=[r'^\s*[\d\s()*/+.-]+\s*$'])
+    return matcher
+
+# Palabras que se quitan del mensaje para quedarse con los términos de búsqueda
+SEARCH_STRIP_KEYWORDS = {'buscar', 'busca', 'search', 'información sobre'}
+
+# --- Herramientas que se ejecutan antes de llamar al modelo ---
+# func(mensaje, spans) -> str; label es la etiqueta con la que el resultado entra al prompt.
+# applies(mensaje, spans) -> bool decide si la herramienta corre cuando su intención no es
+# la ganadora (None = siempre); la de la intención ganadora corre siempre
+Tool = namedtuple("Tool", ["name", "func", "label", "instruction", "timeout", "applies"])
+
+# Pool compartido por todos los bots: los hilos se crean solo cuando hacen falta
+TOOL_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="herramienta")
+
+# --- Métricas por turno ---
+class TurnMetrics:
+    """Tiempos y contadores de un turno (intención, herramientas, red, tokens...)"""
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = {}
+        self.data = {"cache_hit": False, "retries": 0, "tokens_in": None, "tokens_out": None, "error": False}
+    
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans[name] = self.spans.get(name, 0.0) + time.perf_counter() - start
+    
+    def record(self, name, seconds):
+        self.spans[name] = seconds
+    
+    def set_usage(self, usage):
+        """Toma los tokens reportados por la API ('usage' o 'x_groq.usage')"""
+        if usage:
+            self.data["tokens_in"] = usage.get("prompt_tokens")
+            self.data["tokens_out"] = usage.get("completion_tokens")
+    
+    def finish(self, **extra):
+        record = {"timestamp": datetime.now(timezone.utc).isoformat(timespec="milliseconds")}
+        record.update(self.data)
+        record.update(extra)
+        record["total_ms"] = round((time.perf_counter() - self.start) * 1000, 2)
+        for name, seconds in self.spans.items():
+            record[f"{name}_ms"] = round(seconds * 1000, 2)
+        return record
+
+
+class JsonLinesMetricsSink:
+    """Exportador por defecto: una línea JSON por turno"""
+    def __init__(self, path="metricas_chatbot.jsonl"):
+        self.file = open(path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+    
+    def emit(self, record):
+        with self.lock:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.file.flush()
+    
+    def close(self):
+        self.file.close()
+
+
+class RollingStats:
+    """Guarda los últimos N turnos y calcula percentiles p50/p95/p99"""
+    FIELDS = ["total_ms", "ttfb_ms", "network_ms", "tools_ms", "intent_ms", "tokens_in", "tokens_out"]
+    
+    def __init__(self, window=1000):
+        self.records = deque(maxlen=window)
+    
+    def emit(self, record):
+        self.records.append(record)
+    
+    @staticmethod
+    def percentile(sorted_values, pct):
+        index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+        return sorted_values[index]
+    
+    def summary(self):
+        result = {"turns": len(self.records)}
+        if self.records:
+            result["cache_hit_rate"] = sum(r["cache_hit"] for r in self.records) / len(self.records)
+            result["retries"] = sum(r["retries"] for r in self.records)
+        for field in self.FIELDS:
+            values = sorted(r[field] for r in self.records if r.get(field) is not None)
+            if values:
+                result[field] = {f"p{pct}": self.percentile(values, pct) for pct in (50, 95, 99)}
+        return result
+    
+    def format_summary(self):
+        summary = self.summary()
+        lines = [f"{Color.OKCYAN}{Style.BOLD}Métricas de los últimos {summary['turns']} turnos{Style.RESET}"]
+        if summary["turns"]:
+            lines.append(f"  caché: {summary['cache_hit_rate'] * 100:.0f}% aciertos   reintentos: {summary['retries']}")
+        for field in self.FIELDS:
+            if field in summary:
+                p = summary[field]
+                lines.append(f"  {field:<11} p50={p['p50']:<9} p95={p['p95']:<9} p99={p['p99']}")
+        return "\n".join(lines)
+
+# --- Caché de respuestas ---
+class ResponseCache:
+    """Interfaz de caché de respuestas: cualquier objeto con get/set sirve"""
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def make_key(messages, payload):
+        """Hash de los mensajes normalizados (espacios colapsados) + modelo y parámetros de muestreo"""
+        normalized = {
+            "messages": [(m["role"], " ".join(m["content"].split())) for m in messages],
+            "model": payload["model"],
+            "temperature": payload["temperature"],
+            "max_tokens": payload["max_tokens"],
+        }
+        raw = json.dumps(normalized, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    def get(self, key):
+        value = self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+    
+    def set(self, key, value):
+        self._set(key, value)
+    
+    def _get(self, key):
+        raise NotImplementedError
+    
+    def _set(self, key, value):
+        raise NotImplementedError
+
+
+class MemoryResponseCache(ResponseCache):
+    """LRU en memoria con expiración (TTL) por entrada"""
+    def __init__(self, max_entries=512, ttl=3600):
+        super().__init__()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def _get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if time.time() > expires:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+    
+    def _set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.time() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class SQLiteResponseCache(ResponseCache):
+    """Caché en disco (SQLite) que sobrevive entre ejecuciones"""
+    def __init__(self, path="respuestas_cache.db", ttl=24 * 3600):
+        super().__init__()
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS respuestas (clave TEXT PRIMARY KEY, valor TEXT, expira REAL)"
+        )
+        self.conn.commit()
+    
+    def _get(self, key):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT valor, expira FROM respuestas WHERE clave = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if time.time() > row[1]:
+                self.conn.execute("DELETE FROM respuestas WHERE clave = ?", (key,))
+                self.conn.commit()
+                return None
+            return row[0]
+    
+    def _set(self, key, value):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO respuestas VALUES (?, ?, ?)",
+                (key, value, time.time() + self.ttl)
+            )
+            self.conn.commit()
+    
+    def close(self):
+        self.conn.close()
+
 # --- Clase del Chatbot (Renombrada para claridad en el código) ---
 class El_Asistente_ChatBot:
-    def __init__(self, api_key):
+    # Códigos que vale la pena reintentar (rate limit y errores del servidor)
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+    
+    def __init__(self, api_key, base_url=None, stream=True, pool_size=10,
+                 max_retries=3, backoff_base=0.5, backoff_max=8.0, retry_after_max=120.0,
+                 history_budget=6000, summarize_history=False,
+                 response_cache="memory", cache_conversation=False, metrics_sink=None):
         self.api_key = api_key
-        self.base_url = "https://api.groq.com/openai/v1/chat/completions" 
+        self.base_url = base_url or "https://api.groq.com/openai/v1/chat/completions" 
+        self.stream = stream  # Si es True, chat_loop imprime los tokens conforme llegan
         self.conversation_history = []
         self.headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
+        
+        # Reintentos con backoff exponencial + jitter
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max  # Tope de seguridad para el Retry-After del servidor
+        
+        self.setup_transport(pool_size)
+        
+        # Contadores para verificar reuso de conexiones y reintentos
+        self.http_stats = {"requests": 0, "retries": 0}
+        
+        # Historial con presupuesto de tokens (opcionalmente con resumen acumulado)
+        self.history_manager = HistoryManager(
+            budget=history_budget,
+            summarizer=self.summarize_messages if summarize_history else None
+        )
+        
+        # Caché de respuestas: "memory", una instancia de ResponseCache o None para desactivarla.
+        # Las conversaciones con temperatura > 0 solo se cachean si cache_conversation=True
+        self.response_cache = MemoryResponseCache() if response_cache == "memory" else response_cache
+        self.cache_conversation = cache_conversation
+        self.last_intent = 'conversation'
+        
+        # Métricas: percentiles en memoria + un destino opcional (p. ej. JsonLinesMetricsSink)
+        self.metrics = RollingStats()
+        self.metrics_sink = metrics_sink
+        self.turn = TurnMetrics()
+        
+        # Motor de intenciones; se pueden registrar más con self.intents.register(...)
+        self.intents = build_default_intents()
+        
+        # Herramientas por intención: corren en paralelo con límite de tiempo cada una
+        # y un límite total por turno para no retrasar la respuesta
+        self.tool_executor = TOOL_EXECUTOR
+        self.turn_deadline = 8.0
+        self.tools = {}
+        self.register_tool(
+            'web_search',
+            lambda message, spans: self.search_web(self.extract_search_terms(message, spans)),
+            label="Información de Herramienta",
+            instruction="Por favor, responde de forma útil al usuario usando esta información.",
+            timeout=5.0
+        )
+        self.register_tool(
+            'math',
+            lambda message, spans: self.solve_math(message),
+            label="Resultado de Herramienta",
+            instruction="Explica o amplía esta respuesta matemática para el usuario.",
+            timeout=2.0,
+            applies=lambda message, spans: has_math_expression(message)
+        )
+    
+    def setup_transport(self, pool_size):
+        """Sesión con pool de conexiones keep-alive: evita un handshake TCP+TLS por turno"""
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.session.headers["Connection"] = "keep-alive"
+        self.adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
     
     def search_web(self, query):
         """Función de búsqueda web (indicativa)"""
@@ -42,66 +654,196 @@ class El_Asistente_ChatBot:
     def solve_math(self, expression):
         """Resuelve expresiones matematicas básicas y seguras"""
         try:
-            # Limpia la expresión matemática
-            clean_expr = re.sub(r'[^0-9+\-*/().\s]', '', expression)
+            # Limpia la expresión matemática (conserva funciones de math como sqrt o log)
+            clean_expr = extract_math_expression(expression)
             
-            # Evalúa expresiones matemáticas seguras (solo usando el módulo math)
-            allowed_names = {
-                k: v for k, v in math.__dict__.items() 
-                if not k.startswith("__")
-            }
-            allowed_names.update({"abs": abs, "round": round})
-            
-            result = eval(clean_expr, {"__builtins__": {}}, allowed_names)
+            result = evaluate_expression(clean_expr)
             return f"{Color.OKGREEN}{Style.BOLD}Resultado Matemático:{Style.RESET} {result}"
         except Exception as e:
             return f"{Color.FAIL}¡Error de Cálculo!{Style.RESET} No puedo resolver esa expresión: {str(e)}"
     
     def detect_intent(self, message):
         """Detecta la intención del mensaje"""
-        message_lower = message.lower()
-        
-        # Detecta búsqueda web
-        web_keywords = ['buscar', 'busca', 'search', 'google', 'web', 'internet', 'información sobre']
-        if any(keyword in message_lower for keyword in web_keywords):
-            return 'web_search'
+        return self.intents.match(message).intent
+    
+    @staticmethod
+    def extract_search_terms(message, spans):
+        """Quita las palabras de búsqueda (ya localizadas por el matcher) del mensaje"""
+        pieces, last = [], 0
+        for start, end, keyword in spans:
+            if keyword in SEARCH_STRIP_KEYWORDS:
+                pieces.append(message[last:start])
+                last = end
+        pieces.append(message[last:])
+        return " ".join("".join(pieces).lower().split())
+    
+    def build_payload(self, messages, stream=False):
+        """Arma el cuerpo de la petición al endpoint de chat completions"""
+        return {
+            "model": "llama3-8b-8192",  #uso del groq gratis
+            "messages": messages,
+            "max_tokens": 1000,
+            "temperature": 0.7,
+            "stream": stream
+        }
+    
+    def retry_delay(self, attempt, response=None):
+        """Calcula la espera antes del siguiente intento.
         
-        # Detecta matemáticas (mejorada: detecta si hay números y al menos un operador)
-        math_keywords = ['calcular', 'resolver', 'matemática', 'suma', 'resta', 'multiplicar', 'dividir']
-        if any(keyword in message_lower for keyword in math_keywords) or re.search(r'^\s*[\d\s()*/+.-]+\s*$', message):
-            return 'math'
+        Si el servidor manda Retry-After se respeta tal cual (solo con el tope de
+        seguridad retry_after_max): reintentar antes solo gasta los reintentos.
+        """
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return min(max(float(retry_after), 0.0), self.retry_after_max)
+            except ValueError:
+                try:
+                    when = parsedate_to_datetime(retry_after)
+                    wait = (when - datetime.now(timezone.utc)).total_seconds()
+                    return min(max(wait, 0.0), self.retry_after_max)
+                except (TypeError, ValueError):
+                    pass
         
-        return 'conversation'
+        # Backoff exponencial con "full jitter"
+        delay = min(self.backoff_base * (2 ** attempt), self.backoff_max)
+        return random.uniform(0, delay)
+    
+    def post_with_retry(self, payload, stream=False):
+        """Hace el POST usando la sesión compartida, reintentando en 429/5xx y errores de red"""
+        for attempt in range(self.max_retries + 1):
+            is_last = attempt == self.max_retries
+            self.http_stats["requests"] += 1
+            try:
+                response = self.session.post(
+                    self.base_url,
+                    json=payload,
+                    timeout=30,
+                    stream=stream
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                if is_last:
+                    raise
+                self.http_stats["retries"] += 1
+                time.sleep(self.retry_delay(attempt))
+                continue
+            
+            if response.status_code in self.RETRY_STATUS and not is_last:
+                self.http_stats["retries"] += 1
+                delay = self.retry_delay(attempt, response)
+                response.close()
+                time.sleep(delay)
+                continue
+            
+            return response
+    
+    def connection_stats(self):
+        """Devuelve contadores de peticiones, reintentos y conexiones abiertas/reusadas"""
+        pools = self.adapter.poolmanager.pools
+        opened = sum(pools[key].num_connections for key in pools.keys())
+        stats = dict(self.http_stats)
+        stats["connections_opened"] = opened
+        stats["connections_reused"] = max(0, stats["requests"] - opened)
+        return stats
+    
+    def summarize_messages(self, previous_summary, messages):
+        """Pide al modelo un resumen breve de los turnos que salen del historial"""
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        prompt = (
+            f"Resumen actual: {previous_summary or '(vacío)'}\n"
+            f"Nuevos mensajes:\n{transcript}\n"
+            "Actualiza el resumen en máximo 5 frases, conservando datos importantes."
+        )
+        response = self.post_with_retry(self.build_payload([{"role": "user", "content": prompt}]))
+        response.raise_for_status()
+        return response.json()['choices'][0]['message']['content']
+    
+    def close(self):
+        """Cierra las conexiones del pool"""
+        self.session.close()
+    
+    def api_error(self, title, detail):
+        """Mensaje de error de la API; además marca el turno como fallido para que
+        la respuesta (aunque sea un stream cortado a la mitad) no entre a la caché"""
+        self.turn.data["error"] = True
+        return f"{Color.FAIL}{title}{Style.RESET} {detail}"
     
     def call_groq_api(self, messages):
         """Llama a la API de Groq"""
         try:
-            payload = {
-                "model": "llama3-8b-8192",  #uso del groq gratis
-                "messages": messages,
-                "max_tokens": 1000,
-                "temperature": 0.7,
-                "stream": False
-            }
+            payload = self.build_payload(messages)
             
-            response = requests.post(
-                self.base_url,
-                headers=self.headers,
-                json=payload,
-                timeout=30
-            )
+            response = self.post_with_retry(payload)
+            self.turn.record("ttfb", response.elapsed.total_seconds())
             
             if response.status_code == 200:
-                return response.json()['choices'][0]['message']['content']
+                data = response.json()
+                self.turn.set_usage(data.get('usage'))
+                return data['choices'][0]['message']['content']
             else:
-                return f"{Color.FAIL}Error de API (Status {response.status_code}):{Style.RESET} {response.text}"
+                return self.api_error(f"Error de API (Status {response.status_code}):", response.text)
+                
+        except Exception as e:
+            return self.api_error("Error de conexión:", f"No se pudo conectar a Groq: {str(e)}")
+    
+    def stream_groq_api(self, messages):
+        """Llama a la API de Groq en modo streaming y va entregando los tokens (generador)"""
+        try:
+            payload = self.build_payload(messages, stream=True)
+            
+            response = self.post_with_retry(payload, stream=True)
+            
+            if response.status_code != 200:
+                yield self.api_error(f"Error de API (Status {response.status_code}):", response.text)
+                return
+            
+            with response:
+                for delta in self.parse_sse_stream(response.iter_lines(), self.turn):
+                    yield delta
                 
         except Exception as e:
-            return f"{Color.FAIL}Error de conexión:{Style.RESET} No se pudo conectar a Groq: {str(e)}"
+            yield self.api_error("Error de conexión:", f"No se pudo conectar a Groq: {str(e)}")
+    
+    @staticmethod
+    def parse_sse_line(line, turn=None):
+        """Interpreta una línea SSE: devuelve el texto del fragmento, SSE_DONE al
+        terminar el stream o None si la línea no trae contenido. Si se pasa turn,
+        ahí se anota el uso de tokens que llega en el último fragmento"""
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        # Las líneas vacías separan eventos y las que empiezan con ':' son comentarios
+        if not line.startswith('data:'):
+            return None
+        
+        data = line[len('data:'):].strip()
+        if data == '[DONE]':
+            return SSE_DONE
+        
+        chunk = json.loads(data)
+        if turn is not None:
+            turn.set_usage(chunk.get('usage') or chunk.get('x_groq', {}).get('usage'))
+        choices = chunk.get('choices') or [{}]
+        return choices[0].get('delta', {}).get('content') or None
+    
+    @classmethod
+    def parse_sse_stream(cls, lines, turn=None):
+        """Convierte las líneas SSE ('data: {...}') del endpoint en fragmentos de texto"""
+        for line in lines:
+            delta = cls.parse_sse_line(line, turn)
+            if delta is SSE_DONE:
+                break
+            if delta:
+                yield delta
+    
+    def register_tool(self, intent, func, label, instruction, timeout=5.0, applies=None):
+        """Asocia una herramienta a una intención (registra la intención con self.intents.register)"""
+        self.tools[intent] = Tool(intent, func, label, instruction, timeout, applies)
     
-    def process_message(self, user_message):
-        """Procesa el mensaje del usuario y devuelve la respuesta del asistente"""
-        intent = self.detect_intent(user_message)
+    def start_turn(self, user_message):
+        """Detecta la intención y registra el mensaje del usuario en el historial"""
+        with self.turn.span("intent"):
+            match = self.intents.match(user_message)
+        self.last_intent = match.intent
         
         # Añade mensaje del usuario al historial
         self.conversation_history.append({
@@ -109,58 +851,170 @@ class El_Asistente_ChatBot:
             "content": user_message
         })
         
-        messages_to_send = []
+        # Mantiene el historial dentro del presupuesto de tokens
+        with self.turn.span("history"):
+            self.history_manager.compact(self.conversation_history)
         
-        if intent == 'web_search':
-            # Extrae términos de busqueda
-            search_terms = user_message.lower()
-            for keyword in ['buscar', 'busca', 'search', 'información sobre']:
-                search_terms = search_terms.replace(keyword, '').strip()
-            
-            web_result = self.search_web(search_terms)
-            
-            # Mensaje mejorado para Groq
-            enhanced_message = f"El usuario pregunta: {user_message}\n<<Información de Herramienta>>: {web_result}\nPor favor, responde de forma útil al usuario usando esta información."
-            
-            # Usar historial, pero el último mensaje es el mejorado
-            messages_to_send = self.conversation_history[:-1] + [{
-                "role": "user",
-                "content": enhanced_message
-            }]
-            
-        elif intent == 'math':
-            # Intenta resolver matemáticas
-            math_result = self.solve_math(user_message)
-            
-            # Mensaje mejorado para Groq para explicación
-            enhanced_message = f"El usuario solicita: {user_message}\n<<Resultado de Herramienta>>: {math_result}\nExplica o amplía esta respuesta matemática para el usuario."
-            
-            # Usar historial, pero el último mensaje es el mejorado
-            messages_to_send = self.conversation_history[:-1] + [{
-                "role": "user", 
-                "content": enhanced_message
-            }]
-            
-        else:
+        return match
+    
+    def tools_for(self, match, user_message):
+        """Herramientas que dispara el mensaje (puede ser más de una).
+        
+        La de la intención ganadora siempre corre; las demás solo si aplican al
+        mensaje (p. ej. "la resta fiscal" en una búsqueda no es una cuenta)
+        """
+        tools = []
+        for intent in match.matched:
+            tool = self.tools.get(intent)
+            if tool is None:
+                continue
+            if intent == match.intent or tool.applies is None or tool.applies(user_message, match.spans):
+                tools.append(tool)
+        return tools
+    
+    @staticmethod
+    def tool_timeout_message(tool):
+        return f"{Color.WARNING}La herramienta '{tool.name}' no respondió a tiempo.{Style.RESET}"
+    
+    def run_tools(self, tools, user_message, spans):
+        """Ejecuta las herramientas en paralelo y devuelve [(herramienta, resultado), ...]"""
+        if not tools:
+            return []
+        
+        start = time.monotonic()
+        turn_deadline = start + self.turn_deadline
+        futures = [(tool, self.tool_executor.submit(tool.func, user_message, spans)) for tool in tools]
+        
+        results = []
+        for tool, future in futures:
+            wait = min(start + tool.timeout, turn_deadline) - time.monotonic()
+            try:
+                result = future.result(timeout=max(0.0, wait))
+            except FutureTimeoutError:
+                # Si no empezó se cancela; si ya corre, su resultado simplemente se ignora
+                future.cancel()
+                result = self.tool_timeout_message(tool)
+            except Exception as e:
+                result = f"{Color.FAIL}Error en la herramienta '{tool.name}':{Style.RESET} {str(e)}"
+            results.append((tool, result))
+        
+        return results
+    
+    def compose_messages(self, user_message, tool_results):
+        """Historial a enviar; si hubo herramientas, el último mensaje lleva sus resultados"""
+        if not tool_results:
             # Conversación normal
-            messages_to_send = self.conversation_history
+            return self.conversation_history
         
-        # Obtiene respuesta de Groq
-        response = self.call_groq_api(messages_to_send)
+        # Mensaje mejorado para Groq con los resultados de todas las herramientas
+        lines = [f"El usuario pregunta: {user_message}"]
+        lines += [f"<<{tool.label}>>: {result}" for tool, result in tool_results]
+        lines.append(" ".join(tool.instruction for tool, _ in tool_results))
+        enhanced_message = "\n".join(lines)
         
-        # Añade respuesta al historial
+        # Usar historial, pero el último mensaje es el mejorado
+        return self.conversation_history[:-1] + [{
+            "role": "user",
+            "content": enhanced_message
+        }]
+    
+    def prepare_messages(self, user_message):
+        """Registra el mensaje del usuario, ejecuta las herramientas que toquen y
+        devuelve la lista de mensajes a enviar al modelo"""
+        match = self.start_turn(user_message)
+        with self.turn.span("tools"):
+            tool_results = self.run_tools(self.tools_for(match, user_message), user_message, match.spans)
+        return self.compose_messages(user_message, tool_results)
+    
+    def cache_key_for(self, messages):
+        """Clave de caché del turno, o None si este turno no debe cachearse"""
+        if self.response_cache is None:
+            return None
+        payload = self.build_payload(messages)
+        # Los turnos de herramientas son deterministas; la conversación con temperatura > 0 no
+        if self.last_intent == 'conversation' and payload["temperature"] > 0 and not self.cache_conversation:
+            return None
+        return self.response_cache.make_key(messages, payload)
+    
+    def store_in_cache(self, key, response):
+        # Los turnos con error (marcados por api_error) no se guardan
+        if key is not None and not self.turn.data["error"]:
+            self.response_cache.set(key, response)
+    
+    def begin_metrics(self):
+        """Arranca la medición de un turno nuevo"""
+        self.turn = TurnMetrics()
+        self.turn.data["retries"] = self.http_stats["retries"]
+    
+    def finish_turn(self, response, streamed=False):
+        """Añade la respuesta del asistente al historial y publica las métricas del turno"""
         self.conversation_history.append({
             "role": "assistant",
             "content": response
         })
         
+        turn = self.turn
+        turn.data["retries"] = self.http_stats["retries"] - turn.data["retries"]
+        if turn.data["tokens_in"] is None and not turn.data["cache_hit"]:
+            # La API no reportó uso: se estima
+            turn.data["tokens_in"] = sum(self.history_manager.message_tokens(m) for m in self.conversation_history[:-1])
+            turn.data["tokens_out"] = HistoryManager.estimate_tokens(response)
+            turn.data["tokens_estimated"] = True
+        record = turn.finish(intent=self.last_intent, stream=streamed)
+        
+        self.metrics.emit(record)
+        if self.metrics_sink is not None:
+            try:
+                self.metrics_sink.emit(record)
+            except Exception:
+                pass  # Las métricas nunca deben tumbar una conversación
         return response
     
+    def process_message(self, user_message, on_token=None):
+        """Procesa el mensaje del usuario y devuelve la respuesta del asistente.
+        
+        Si se pasa on_token, la respuesta se pide en modo streaming y cada
+        fragmento se entrega a on_token conforme llega.
+        """
+        self.begin_metrics()
+        messages_to_send = self.prepare_messages(user_message)
+        
+        # Si ya se respondió exactamente lo mismo, no hace falta ir a Groq
+        with self.turn.span("cache"):
+            cache_key = self.cache_key_for(messages_to_send)
+            cached = self.response_cache.get(cache_key) if cache_key else None
+        self.turn.data["cache_hit"] = cached is not None
+        
+        # Obtiene respuesta de Groq
+        with self.turn.span("network"):
+            if cached is not None:
+                response = cached
+                if on_token is not None:
+                    on_token(response)
+            elif on_token is None:
+                response = self.call_groq_api(messages_to_send)
+            else:
+                parts = []
+                start = time.perf_counter()
+                for delta in self.stream_groq_api(messages_to_send):
+                    if not parts:
+                        self.turn.record("ttfb", time.perf_counter() - start)
+                    on_token(delta)
+                    parts.append(delta)
+                response = "".join(parts)
+        
+        if cached is None:
+            self.store_in_cache(cache_key, response)
+        
+        # Añade respuesta al historial
+        return self.finish_turn(response, streamed=on_token is not None)
+    
     def chat_loop(self):
         """Bucle principal del chat"""
         print(f"\n{Color.OKCYAN}{Style.BOLD}--- {Style.ITALIC}Bienvenido al Chatbot El asistente{Style.RESET}{Color.OKCYAN}{Style.BOLD} ---{Style.RESET}")
         print(f"{Color.OKBLUE}Hola, soy El asistente. Estoy aquí para ayudarte.{Style.RESET}")
-        print(f"Escribe {Color.WARNING}'salir'{Style.RESET} para terminar la conversación.\n")
+        print(f"Escribe {Color.WARNING}'salir'{Style.RESET} para terminar la conversación "
+              f"o {Color.WARNING}'/stats'{Style.RESET} para ver las métricas de latencia.\n")
         
         while True:
             try:
@@ -173,9 +1027,19 @@ class El_Asistente_ChatBot:
                 if not user_input:
                     continue
                 
-                print(f"{Color.OKBLUE}El asistente:{Style.RESET} {Style.ITALIC}Ta pensando...{Style.RESET}")
-                response = self.process_message(user_input)
-                print(f"{Color.OKBLUE}{Style.BOLD}El asistente:{Style.RESET} {response}\n")
+                if user_input.lower() in ['/stats', '/metricas']:
+                    print(self.metrics.format_summary() + "\n")
+                    continue
+                
+                if self.stream:
+                    # Imprime los tokens conforme llegan en lugar de esperar la respuesta completa
+                    print(f"{Color.OKBLUE}{Style.BOLD}El asistente:{Style.RESET} ", end="", flush=True)
+                    self.process_message(user_input, on_token=lambda delta: print(delta, end="", flush=True))
+                    print("\n")
+                else:
+                    print(f"{Color.OKBLUE}El asistente:{Style.RESET} {Style.ITALIC}Ta pensando...{Style.RESET}")
+                    response = self.process_message(user_input)
+                    print(f"{Color.OKBLUE}{Style.BOLD}El asistente:{Style.RESET} {response}\n")
                 
             except KeyboardInterrupt:
                 print(f"\n{Color.WARNING}El asistente:{Style.RESET} Conversación interrumpida. ¡Hasta pronto!")
@@ -183,7 +1047,503 @@ class El_Asistente_ChatBot:
             except Exception as e:
                 print(f"{Color.FAIL}Error inesperado: {str(e)}{Style.RESET}\n")
 
+# --- Límite de peticiones del lado del cliente ---
+class AsyncRateLimiter:
+    """Dos cubetas de tokens: peticiones por minuto y tokens por minuto.
+    
+    Los que esperan se atienden en orden de llegada.
+    """
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.rpm = requests_per_minute
+        self.tpm = tokens_per_minute
+        self.request_bucket = float(requests_per_minute or 0)
+        self.token_bucket = float(tokens_per_minute or 0)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+    
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        if self.rpm:
+            self.request_bucket = min(self.rpm, self.request_bucket + elapsed * self.rpm / 60)
+        if self.tpm:
+            self.token_bucket = min(self.tpm, self.token_bucket + elapsed * self.tpm / 60)
+    
+    async def acquire(self, tokens=0):
+        async with self.lock:
+            if self.tpm:
+                tokens = min(tokens, self.tpm)  # Una petición enorme no puede esperar para siempre
+            while True:
+                self._refill()
+                wait = 0.0
+                if self.rpm and self.request_bucket < 1:
+                    wait = max(wait, (1 - self.request_bucket) * 60 / self.rpm)
+                if self.tpm and self.token_bucket < tokens:
+                    wait = max(wait, (tokens - self.token_bucket) * 60 / self.tpm)
+                if wait == 0.0:
+                    break
+                await asyncio.sleep(wait)
+            
+            if self.rpm:
+                self.request_bucket -= 1
+            if self.tpm:
+                self.token_bucket -= tokens
+
+# --- Motor asíncrono: muchas conversaciones en un solo proceso ---
+class AsyncChatBot(El_Asistente_ChatBot):
+    """Variante asíncrona del chatbot que comparte una sesión aiohttp.
+    
+    El candado por sesión mantiene en orden los turnos de una misma
+    conversación aunque lleguen mensajes concurrentes.
+    """
+    def __init__(self, api_key, http_session, base_url=None, **kwargs):
+        # El resumen del historial hace una llamada bloqueante, aquí no se usa
+        kwargs["summarize_history"] = False
+        super().__init__(api_key, base_url=base_url, stream=False, **kwargs)
+        self.http_session = http_session
+        self.lock = asyncio.Lock()
+        self.rate_limiter = None  # AsyncRateLimiter opcional, compartido entre sesiones
+    
+    def setup_transport(self, pool_size):
+        """Sin sesión de requests: el pool aiohttp lo pone (y lo cierra) el registro"""
+        self.session = None
+        self.adapter = None
+    
+    async def post_with_retry(self, payload):
+        """POST asíncrono con los mismos reintentos que la versión síncrona"""
+        prompt_tokens = sum(HistoryManager.estimate_tokens(m["content"]) for m in payload["messages"])
+        for attempt in range(self.max_retries + 1):
+            is_last = attempt == self.max_retries
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire(prompt_tokens)
+            self.http_stats["requests"] += 1
+            try:
+                response = await self.http_session.post(
+                    self.base_url,
+                    json=payload,
+                    timeout=aiohttp.ClientTimeout(total=30)
+                )
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if is_last:
+                    raise
+                self.http_stats["retries"] += 1
+                await asyncio.sleep(self.retry_delay(attempt))
+                continue
+            
+            if response.status in self.RETRY_STATUS and not is_last:
+                self.http_stats["retries"] += 1
+                delay = self.retry_delay(attempt, response)
+                response.release()
+                await asyncio.sleep(delay)
+                continue
+            
+            return response
+    
+    async def call_groq_api(self, messages):
+        """Llama a la API de Groq sin bloquear el event loop"""
+        try:
+            start = time.perf_counter()
+            response = await self.post_with_retry(self.build_payload(messages))
+            self.turn.record("ttfb", time.perf_counter() - start)
+            async with response:
+                if response.status == 200:
+                    data = await response.json()
+                    self.turn.set_usage(data.get('usage'))
+                    return data['choices'][0]['message']['content']
+                return self.api_error(f"Error de API (Status {response.status}):", await response.text())
+        
+        except Exception as e:
+            return self.api_error("Error de conexión:", f"No se pudo conectar a Groq: {str(e)}")
+    
+    async def stream_groq_api(self, messages):
+        """Versión streaming asíncrona (generador asíncrono de fragmentos)"""
+        try:
+            response = await self.post_with_retry(self.build_payload(messages, stream=True))
+            async with response:
+                if response.status != 200:
+                    yield self.api_error(f"Error de API (Status {response.status}):", await response.text())
+                    return
+                
+                async for line in response.content:
+                    delta = self.parse_sse_line(line.strip(), self.turn)
+                    if delta is SSE_DONE:
+                        break
+                    if delta:
+                        yield delta
+        
+        except Exception as e:
+            yield self.api_error("Error de conexión:", f"No se pudo conectar a Groq: {str(e)}")
+    
+    async def process_message(self, user_message, on_token=None):
+        """Procesa un turno; los turnos de la misma sesión se atienden en orden"""
+        async with self.lock:
+            self.begin_metrics()
+            messages_to_send = await self.prepare_messages_async(user_message)
+            
+            with self.turn.span("cache"):
+                cache_key = self.cache_key_for(messages_to_send)
+                cached = self.response_cache.get(cache_key) if cache_key else None
+            self.turn.data["cache_hit"] = cached is not None
+            
+            with self.turn.span("network"):
+                if cached is not None:
+                    response = cached
+                    if on_token is not None:
+                        on_token(response)
+                elif on_token is None:
+                    response = await self.call_groq_api(messages_to_send)
+                else:
+                    parts = []
+                    start = time.perf_counter()
+                    async for delta in self.stream_groq_api(messages_to_send):
+                        if not parts:
+                            self.turn.record("ttfb", time.perf_counter() - start)
+                        on_token(delta)
+                        parts.append(delta)
+                    response = "".join(parts)
+            
+            if cached is None:
+                self.store_in_cache(cache_key, response)
+            
+            return self.finish_turn(response, streamed=on_token is not None)
+    
+    async def run_tools_async(self, tools, user_message, spans):
+        """Versión asíncrona de run_tools: espera las herramientas sin bloquear el event loop"""
+        if not tools:
+            return []
+        
+        loop = asyncio.get_running_loop()
+        tasks = [
+            asyncio.ensure_future(asyncio.wait_for(
+                loop.run_in_executor(self.tool_executor, tool.func, user_message, spans),
+                tool.timeout
+            ))
+            for tool in tools
+        ]
+        # Límite total del turno: lo que siga pendiente se cancela
+        await asyncio.wait(tasks, timeout=self.turn_deadline)
+        
+        results = []
+        for tool, task in zip(tools, tasks):
+            if not task.done():
+                task.cancel()
+                results.append((tool, self.tool_timeout_message(tool)))
+            elif isinstance(task.exception(), asyncio.TimeoutError):
+                results.append((tool, self.tool_timeout_message(tool)))
+            elif task.exception() is not None:
+                results.append((tool, f"{Color.FAIL}Error en la herramienta '{tool.name}':{Style.RESET} {str(task.exception())}"))
+            else:
+                results.append((tool, task.result()))
+        return results
+    
+    async def prepare_messages_async(self, user_message):
+        match = self.start_turn(user_message)
+        with self.turn.span("tools"):
+            tool_results = await self.run_tools_async(self.tools_for(match, user_message), user_message, match.spans)
+        return self.compose_messages(user_message, tool_results)
+    
+    def connection_stats(self):
+        return dict(self.http_stats)
+    
+    def close(self):
+        """La sesión HTTP pertenece al registro, aquí no se cierra"""
+        pass
+
+
+class ChatSessionRegistry:
+    """Registro de conversaciones que comparten un pool de conexiones.
+    
+    Uso:
+        async with ChatSessionRegistry(api_key) as registry:
+            respuesta = await registry.process_message("usuario-1", "Hola")
+    """
+    def __init__(self, api_key, base_url=None, pool_size=100, rate_limiter=None, **bot_kwargs):
+        if aiohttp is None:
+            raise ImportError("El motor asíncrono necesita aiohttp: pip install aiohttp")
+        self.api_key = api_key
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.rate_limiter = rate_limiter
+        # Todas las sesiones comparten la misma caché de respuestas ("memory" = una sola en memoria)
+        if bot_kwargs.get("response_cache", "memory") == "memory":
+            bot_kwargs["response_cache"] = MemoryResponseCache()
+        self.bot_kwargs = bot_kwargs
+        self.sessions = {}
+        self.http_session = None
+        self.metrics = RollingStats()  # Percentiles de todas las sesiones juntas
+    
+    async def start(self):
+        connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+        self.http_session = aiohttp.ClientSession(
+            connector=connector,
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            }
+        )
+        return self
+    
+    async def close(self):
+        if self.http_session is not None:
+            await self.http_session.close()
+            self.http_session = None
+    
+    async def __aenter__(self):
+        return await self.start()
+    
+    async def __aexit__(self, *exc_info):
+        await self.close()
+    
+    def get(self, session_id):
+        """Devuelve el bot de la sesión, creándolo la primera vez"""
+        bot = self.sessions.get(session_id)
+        if bot is None:
+            bot = AsyncChatBot(self.api_key, self.http_session, base_url=self.base_url, **self.bot_kwargs)
+            bot.rate_limiter = self.rate_limiter
+            bot.metrics = self.metrics
+            self.sessions[session_id] = bot
+        return bot
+    
+    def remove(self, session_id):
+        self.sessions.pop(session_id, None)
+    
+    async def process_message(self, session_id, user_message, on_token=None):
+        return await self.get(session_id).process_message(user_message, on_token=on_token)
+
+
+async def start_stub_api(delay=0.05):
+    """Levanta una API falsa local que imita chat completions (para pruebas de carga).
+    
+    Con "stream": true responde como Groq: fragmentos SSE ("data: {...}"), el
+    uso de tokens en el último fragmento y "data: [DONE]" al final.
+    """
+    async def handle(request):
+        body = await request.json()
+        await asyncio.sleep(delay)
+        last = body["messages"][-1]["content"]
+        content = f"eco: {last}"
+        usage = {"prompt_tokens": len(body["messages"]), "completion_tokens": len(content.split())}
+        
+        if not body.get("stream"):
+            return web.json_response({
+                "choices": [{"message": {"role": "assistant", "content": content}}],
+                "usage": usage
+            })
+        
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        words = content.split(" ")
+        for i, word in enumerate(words):
+            chunk = {"choices": [{"delta": {"content": word if i == 0 else " " + word}}]}
+            if i == len(words) - 1:
+                chunk["x_groq"] = {"usage": usage}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            await asyncio.sleep(0)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+    
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://127.0.0.1:{port}/v1/chat/completions"
+
+
+async def load_test(sessions=200, turns=3, base_url=None, api_key="stub", pool_size=100):
+    """Simula N conversaciones concurrentes contra una API (por defecto la falsa local)"""
+    if aiohttp is None:
+        raise ImportError("La prueba de carga necesita aiohttp: pip install aiohttp")
+    
+    runner = None
+    if base_url is None:
+        runner, base_url = await start_stub_api()
+    
+    latencies = []
+    
+    async def simulated_user(registry, session_id):
+        for turn in range(turns):
+            start = time.perf_counter()
+            await registry.process_message(session_id, f"Hola, turno {turn} de {session_id}")
+            latencies.append(time.perf_counter() - start)
+    
+    try:
+        async with ChatSessionRegistry(api_key, base_url=base_url, pool_size=pool_size) as registry:
+            start = time.perf_counter()
+            await asyncio.gather(*(simulated_user(registry, f"sesion-{i}") for i in range(sessions)))
+            elapsed = time.perf_counter() - start
+            
+            # Cada sesión debe terminar con sus turnos completos y en orden
+            ok = all(len(bot.conversation_history) == turns * 2 for bot in registry.sessions.values())
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+    
+    latencies.sort()
+    print(f"{Color.OKCYAN}{Style.BOLD}Prueba de carga:{Style.RESET} {sessions} sesiones x {turns} turnos")
+    print(f"  Tiempo total: {elapsed:.2f}s  ({len(latencies) / elapsed:.1f} turnos/s)")
+    print(f"  Latencia p50: {latencies[len(latencies) // 2] * 1000:.1f} ms  "
+          f"p95: {latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms")
+    print(f"  Historiales completos: {'sí' if ok else 'NO'}")
+    return elapsed, latencies
+
+# --- Modo por lotes (no interactivo) ---
+ANSI_ESCAPE = re.compile(r'\033\[[0-9;]*m')
+
+def strip_ansi(text):
+    return ANSI_ESCAPE.sub('', text)
+
+
+async def run_batch(input_file, output_file, api_key, base_url=None, concurrency=16,
+                    requests_per_minute=None, tokens_per_minute=None, response_cache="memory",
+                    metrics_sink=None):
+    """Procesa un JSONL de prompts con concurrencia acotada y límite de peticiones.
+    
+    Cada línea es {"prompt": "..."} o {"messages": [...]} (conversación completa
+    cuyo último mensaje es del usuario), con un "id" opcional. Los resultados se
+    escriben conforme terminan, con el índice de la línea original.
+    """
+    if aiohttp is None:
+        raise ImportError("El modo por lotes necesita aiohttp: pip install aiohttp")
+    
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    limiter = None
+    if requests_per_minute or tokens_per_minute:
+        limiter = AsyncRateLimiter(requests_per_minute, tokens_per_minute)
+    stats = {"ok": 0, "errors": 0}
+    
+    def write_result(result):
+        output_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+        output_file.flush()
+    
+    async def handle(registry, index, item):
+        session_id = f"lote-{index}"
+        bot = registry.get(session_id)
+        start = time.perf_counter()
+        try:
+            if "_error" in item:
+                raise ValueError(item["_error"])
+            if "messages" in item:
+                bot.conversation_history = list(item["messages"][:-1])
+                prompt = item["messages"][-1]["content"]
+            else:
+                prompt = item["prompt"]
+            response = await bot.process_message(prompt)
+            error = bot.turn.data["error"]
+        except Exception as e:
+            response, error = f"Entrada inválida: {str(e)}", True
+        finally:
+            registry.remove(session_id)
+        
+        stats["errors" if error else "ok"] += 1
+        write_result({
+            "index": index,
+            "id": item.get("id"),
+            "response": strip_ansi(response),
+            "error": error,
+            "elapsed": round(time.perf_counter() - start, 3)
+        })
+    
+    async def worker(registry):
+        while True:
+            entry = await queue.get()
+            if entry is None:
+                return
+            await handle(registry, *entry)
+    
+    async with ChatSessionRegistry(api_key, base_url=base_url, pool_size=concurrency,
+                                   rate_limiter=limiter, response_cache=response_cache,
+                                   metrics_sink=metrics_sink) as registry:
+        workers = [asyncio.ensure_future(worker(registry)) for _ in range(concurrency)]
+        
+        # Lee la entrada poco a poco (stdin puede ser un pipe lento)
+        index = 0
+        while True:
+            line = await loop.run_in_executor(None, input_file.readline)
+            if not line:
+                break
+            line = line.strip()
+            if line:
+                try:
+                    item = json.loads(line)
+                except json.JSONDecodeError as e:
+                    item = {"prompt": None, "_error": str(e)}
+                if isinstance(item, str):
+                    item = {"prompt": item}
+                elif not isinstance(item, dict):
+                    item = {"prompt": None, "_error": f"se esperaba un objeto JSON, llegó {type(item).__name__}"}
+                await queue.put((index, item))
+            index += 1
+        
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    
+    stats["metrics"] = registry.metrics
+    return stats
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Chatbot impulsado por Groq (El asistente)")
+    parser.add_argument("--load-test", type=int, metavar="N",
+                        help="Simula N sesiones concurrentes contra una API falsa local")
+    parser.add_argument("--turns", type=int, default=3, help="Turnos por sesión en la prueba de carga")
+    parser.add_argument("--bench-math", action="store_true",
+                        help="Compara el evaluador matemático compilado contra el anterior")
+    parser.add_argument("--cache-db", metavar="RUTA",
+                        help="Guarda la caché de respuestas en un archivo SQLite en lugar de en memoria")
+    parser.add_argument("--batch", metavar="ENTRADA",
+                        help="Modo por lotes: JSONL con prompts o conversaciones ('-' para stdin)")
+    parser.add_argument("--output", metavar="SALIDA", default="-",
+                        help="JSONL de resultados del modo por lotes ('-' para stdout)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Peticiones simultáneas en modo por lotes")
+    parser.add_argument("--rpm", type=int, help="Límite de peticiones por minuto")
+    parser.add_argument("--tpm", type=int, help="Límite de tokens (estimados) por minuto")
+    parser.add_argument("--base-url", help="URL del endpoint de chat completions (por defecto, Groq)")
+    parser.add_argument("--metrics", metavar="RUTA",
+                        help="Exporta las métricas de cada turno a un archivo JSON lines")
+    args = parser.parse_args()
+    
+    if args.batch:
+        api_key = os.environ.get("GROQ_API_KEY")
+        if not api_key:
+            print(f"{Color.FAIL}¡ADVERTENCIA!{Style.RESET} Define GROQ_API_KEY para usar el modo por lotes.", file=sys.stderr)
+            return
+        
+        cache = SQLiteResponseCache(args.cache_db) if args.cache_db else "memory"
+        input_file = sys.stdin if args.batch == "-" else open(args.batch, encoding="utf-8")
+        output_file = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+        try:
+            start = time.perf_counter()
+            stats = asyncio.run(run_batch(
+                input_file, output_file, api_key, base_url=args.base_url,
+                concurrency=args.concurrency, requests_per_minute=args.rpm,
+                tokens_per_minute=args.tpm, response_cache=cache,
+                metrics_sink=JsonLinesMetricsSink(args.metrics) if args.metrics else None
+            ))
+            print(f"{Color.OKGREEN}Lote terminado:{Style.RESET} {stats['ok']} ok, {stats['errors']} con error "
+                  f"en {time.perf_counter() - start:.1f}s", file=sys.stderr)
+            print(stats["metrics"].format_summary(), file=sys.stderr)
+        finally:
+            if input_file is not sys.stdin:
+                input_file.close()
+            if output_file is not sys.stdout:
+                output_file.close()
+        return
+    
+    if args.bench_math:
+        benchmark_math()
+        return
+    
+    if args.load_test:
+        asyncio.run(load_test(sessions=args.load_test, turns=args.turns, base_url=args.base_url))
+        return
+    
     # Configuración
     print(f"\n{Color.HEADER}================================================={Style.RESET}")
     print(f"{Color.HEADER}{Style.BOLD}        Chatbot impulsado por Groq (El asistente)    {Style.RESET}")
@@ -198,8 +1558,11 @@ def main():
     
     # Inicializa y ejecuta el chatbot
     try:
-        bot = El_Asistente_ChatBot(api_key)
+        cache = SQLiteResponseCache(args.cache_db) if args.cache_db else "memory"
+        sink = JsonLinesMetricsSink(args.metrics) if args.metrics else None
+        bot = El_Asistente_ChatBot(api_key, base_url=args.base_url, response_cache=cache, metrics_sink=sink)
         bot.chat_loop()
+        bot.close()
     except Exception as e:
         print(f"{Color.FAIL}Error al inicializar el bot: {str(e)}{Style.RESET}")
 
@@ -4,9 +4,10 @@ import pyautogui
 import time
 from collections import deque
 import math
+from clasificador_piel import SkinClassifier
 
 class SimpleHandController:
-    def __init__(self):
+    def __init__(self, skin_classifier=None):
         """Controlador de gestos simple usando detección de color"""
         # Configuración de cámara
         self.cap = cv2.VideoCapture(0)
@@ -30,6 +31,10 @@ class SimpleHandController:
         self.skin_lower = np.array([0, 20, 70])
         self.skin_upper = np.array([20, 255, 255])
         
+        # Tabla de color precalculada: solo se rehace al calibrar
+        self.skin = skin_classifier or SkinClassifier.from_thresholds(hsv=(self.skin_lower, self.skin_upper))
+        self.kernel = np.ones((5, 5), np.uint8)
+        
         # Solo control del mouse en toda la pantalla
         self.mouse_control_active = True
         
@@ -63,6 +68,7 @@ class SimpleHandController:
                 255,
                 255
             ])
+            self.skin.set_thresholds(hsv=(self.skin_lower, self.skin_upper))
             
             print(f"✅ Color calibrado: HSV {color}")
             print(f"   Rango: {self.skin_lower} - {self.skin_upper}")
@@ -71,16 +77,12 @@ class SimpleHandController:
 
     def detect_hand_center(self, frame):
         """Detecta el centro del objeto/mano más grande"""
-        # Convertir a HSV
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-        
-        # Crear máscara de color
-        mask = cv2.inRange(hsv, self.skin_lower, self.skin_upper)
+        # Crear máscara de color (una búsqueda en la tabla, sin convertir a HSV)
+        mask = self.skin.mask(frame)
         
         # Aplicar filtros para limpiar la máscara
-        kernel = np.ones((5, 5), np.uint8)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self.kernel)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, self.kernel)
         mask = cv2.medianBlur(mask, 15)
         
         # Encontrar contornos